@@ -0,0 +1,215 @@
+#BENCHMARKS FOR repetitions_finder
+#Motivation: to see if a change makes the detection and cleaning faster or slower, and if it changes what they return
+#Process: generates Whisper-like transcripts of growing sizes, measures the time and peak memory of every stage,
+         #fits how the time grows with the size and compares the outputs with a reference version of the module from git
+#Example: python benchmark.py --sizes 1K 10K 100K 1M --engine suffix_array --reference HEAD~1
+
+import argparse, json, math, os, random, subprocess, sys, time, tracemalloc, types
+import repetitions_finder as rf
+
+
+
+#GENERATING A TRANSCRIPT
+#Motivation: to get texts that look like Whisper outputs, with hallucinated repetitions in a controlled amount
+#Process: writes sentences from a small vocabulary until the text is size characters long
+         #with the probability density, a piece of unit_length words is repeated 3 to 10 times instead (a spaced repetition)
+         #with the probability density/3, a syllable is repeated merged_length times inside a word (a merged repetition)
+         #every segment gets its text and its words, each with made up timestamps
+#Asssosiated parameters: size, density, unit_length, merged_length, seed
+#Example: generate_segments(200, density=0.2) -> [{"id": 0, "start": 0.0, "end": 1.5, "text": " Thank you, thank you, thank you.", "words": [...]}, ...]
+vocabulary = ("the a I you we they it is was and so but okay yes no well thank music going to be have "
+              "know think right really just like what this that there here now then people time").split()
+syllables = ["ha", "la", "e", "o", "na", "uh"]
+
+def generate_segments(size: int, density: float=0.05, unit_length: int=3, merged_length: int=20, seed: int=0) -> list:
+    rng = random.Random(seed)
+    segments, length, clock = [], 0, 0.0
+    while length < size:
+        roll = rng.random()
+        if roll < density:
+            unit = [rng.choice(vocabulary) for _ in range(unit_length)]
+            words = [word+rng.choice(["", "", ","]) for _ in range(rng.randint(3, 10)) for word in unit]
+        elif roll < density*4/3:
+            words = [rng.choice(vocabulary)+rng.choice(syllables)*merged_length+rng.choice(["", "!", "."])]
+        else: words = [rng.choice(vocabulary) for _ in range(rng.randint(4, 15))]
+        words[0] = words[0].capitalize()
+        words[-1] = words[-1].rstrip(",")+rng.choice([".", "?", "!"])
+
+        text = " "+" ".join(words)
+        timed_words = [{"word": " "+word, "start": round(clock+i*0.3, 2), "end": round(clock+i*0.3+0.25, 2)} for i, word in enumerate(words)]
+        segments.append({"id": len(segments), "start": round(clock, 2), "end": round(clock+len(words)*0.3, 2), "text": text, "words": timed_words})
+        length += len(text)
+        clock += len(words)*0.3
+
+    return segments
+
+
+def generate_text(size: int, **kwargs) -> str:
+    return "".join([segment["text"] for segment in generate_segments(size, **kwargs)])
+
+
+
+#LOADING THE REFERENCE
+#Motivation: to compare the outputs with another version of the module without keeping a copy of it in the repository
+#Process: reads repetitions_finder.py at the given git revision and loads it as a separate module
+#Example: load_reference("HEAD~3") -> <module 'repetitions_finder_reference'>
+def load_reference(revision: str) -> types.ModuleType:
+    directory = os.path.dirname(os.path.abspath(__file__))
+    source = subprocess.run(["git", "show", f"{revision}:repetitions_finder.py"], cwd=directory,
+                            capture_output=True, text=True, check=True).stdout
+    module = types.ModuleType("repetitions_finder_reference")
+    exec(compile(source, f"{revision}:repetitions_finder.py", "exec"), module.__dict__)
+    return module
+
+
+
+#MEASURING A STAGE
+#Motivation: to get the time and peak memory of one call
+#Process: the time is measured without tracemalloc, as it slows the code down, the peak memory in a second call with it
+#Example: measure(rf.preprocess, "Oneee") -> {"seconds": 1.2e-05, "peak_mb": 0.0012}
+def measure(function, *args, memory: bool=True, **kwargs) -> dict:
+    started = time.perf_counter()
+    function(*args, **kwargs)
+    result = {"seconds": time.perf_counter()-started}
+    if memory:
+        tracemalloc.start()
+        function(*args, **kwargs)
+        result["peak_mb"] = tracemalloc.get_traced_memory()[1]/2**20
+        tracemalloc.stop()
+    return result
+
+
+#THE STAGES THAT ARE MEASURED
+#Motivation: to measure every stage on its own input, so a slow stage can be told apart from the ones around it
+#Process: every stage gets the text, the segments, the preprocessed text and the found repetitions and spans, and takes what it needs
+         #the inputs that have to be computed are listed in needs, so they are only computed for the stages that are still measured
+         #find_spans_many searches for hundreds of patterns sharing their first letters, to see how the span search scales with their number
+needs = {"has_repetitions": ["preprocessed"], "find_spaced_repetitions": ["preprocessed"], "find_merged_repetitions": ["preprocessed"],
+         "find_spans": ["preprocessed", "repetitions"], "find_spans_many": ["preprocessed", "patterns"], "pad_text": ["preprocessed", "repetitions", "spans"]}
+
+def stages(engine: str) -> dict:
+    return {"preprocess": lambda data: rf.preprocess(data["text"]),
+            "has_repetitions": lambda data: rf.has_repetitions(data["preprocessed"], preprocessed=True),
+            "find_spaced_repetitions": lambda data: rf.find_spaced_repetitions(data["preprocessed"], preprocessed=True, engine=engine),
+            "find_merged_repetitions": lambda data: rf.find_merged_repetitions(data["preprocessed"], preprocessed=True),
+            "find_spans": lambda data: rf.find_spans(data["preprocessed"], data["repetitions"], preprocessed=True, engine=engine),
+            "find_spans_many": lambda data: rf.find_spans(data["preprocessed"], data["patterns"], preprocessed=True, engine=engine),
+            "pad_text": lambda data: rf.pad_text(data["text"], data["spans"]),
+            "clean_segments": lambda data: rf.clean_segments(data["segments"], engine=engine),
+            "clean": lambda data: rf.clean({"text": data["text"], "segments": data["segments"]}, engine=engine)}
+
+
+#COMPARING WITH THE REFERENCE
+#Motivation: to make sure that a faster version still returns the same
+#Process: runs the public functions of both modules on the same data and names the ones that return something different
+def compare(reference: types.ModuleType, data: dict, engine: str) -> list:
+    checks = {"find_repetitions": lambda module: module.find_repetitions(data["text"], engine=engine),
+              "find_spans": lambda module: module.find_spans(data["text"], engine=engine),
+              "clean_text": lambda module: module.clean_text(data["text"], engine=engine),
+              "clean_segments": lambda module: module.clean_segments(data["segments"], engine=engine)}
+    return [name for name, check in checks.items() if check(rf) != check(reference)]
+
+
+#FITTING THE COMPLEXITY CURVE
+#Motivation: to see at a glance if a stage grows linearly, quadratically or worse
+#Process: fits log(seconds) = k*log(size) + c with least squares, k is the exponent (1 is linear, 2 is quadratic)
+#Example: [(1000, 0.01), (10000, 0.1), (100000, 1.0)] -> 1.0
+def growth_exponent(points: list) -> float:
+    points = [(math.log(size), math.log(seconds)) for size, seconds in points if seconds > 0]
+    if len(points) < 2: return float("nan")
+    mean_x = sum(x for x, _ in points)/len(points)
+    mean_y = sum(y for _, y in points)/len(points)
+    spread = sum((x-mean_x)**2 for x, _ in points)
+    return sum((x-mean_x)*(y-mean_y) for x, y in points)/spread if spread > 0 else float("nan")
+
+
+#PATTERNS FOR find_spans_many
+#Motivation: a transcript with many hallucinations has hundreds of repetitions, most of them starting with the same few letters
+#Process: takes the distinct words and pairs of words of the text, in the order they appear, until there are count of them
+#Example: many_patterns("a b a c", 3) -> ["a", "a b", "b"]
+def many_patterns(text: str, count: int) -> list:
+    words = text.split()
+    patterns = dict.fromkeys(pattern for i in range(len(words)) for pattern in (words[i], " ".join(words[i:i+2])))
+    return list(patterns)[:count]
+
+
+def parse_size(size: str) -> int:
+    units = {"K": 10**3, "M": 10**6, "G": 10**9}
+    size = size.strip().upper().rstrip("B")
+    return int(float(size[:-1])*units[size[-1]]) if size[-1] in units else int(size)
+
+
+
+#RUNNING THE BENCHMARKS
+#Process: for every size, generates a transcript and measures every stage, a stage is not run for bigger sizes once it took longer than --max-seconds
+         #the preprocessed text, repetitions and spans are only computed if a stage that is still measured needs them,
+         #once computing one of them took longer than --max-seconds, the stages that need it are not run for bigger sizes either
+         #prints a table of seconds and peak megabytes for every stage and size and the growth exponent of every stage
+def main(argv: list=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the stages of repetitions_finder on generated transcripts.")
+    parser.add_argument("--sizes", nargs="+", default=["1K", "10K", "100K", "1M"], help="transcript sizes in characters, e.g. 1K 10K 50M")
+    parser.add_argument("--engine", choices=["ngrams", "suffix_array", "numpy"], default=rf.defaults["engine"])
+    parser.add_argument("--density", type=float, default=0.05, help="how often a hallucinated repetition starts")
+    parser.add_argument("--unit-length", type=int, default=3, help="the number of words in a repeated piece")
+    parser.add_argument("--merged-length", type=int, default=20, help="how many times a syllable repeats inside a word")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--patterns", type=int, default=500, help="the number of patterns searched by find_spans_many")
+    parser.add_argument("--stages", nargs="+", choices=list(stages("ngrams")), help="only measure these stages")
+    parser.add_argument("--max-seconds", type=float, default=60, help="stop measuring a stage on bigger sizes once it took this long")
+    parser.add_argument("--no-memory", action="store_true", help="do not measure the peak memory")
+    parser.add_argument("--reference", metavar="REVISION", help="a git revision of repetitions_finder.py to compare the outputs with")
+    parser.add_argument("--check-up-to", default="100K", help="only compare the outputs for sizes up to this")
+    parser.add_argument("--json", metavar="PATH", help="also write the results to a json file")
+    args = parser.parse_args(argv)
+
+    sizes = sorted(parse_size(size) for size in args.sizes)
+    chosen = {name: stage for name, stage in stages(args.engine).items() if args.stages == None or name in args.stages}
+    reference = load_reference(args.reference) if args.reference != None else None
+    results, too_slow = {name: {} for name in chosen}, set()
+    mismatches = {}
+
+    for size in sizes:
+        segments = generate_segments(size, density=args.density, unit_length=args.unit_length,
+                                     merged_length=args.merged_length, seed=args.seed)
+        data = {"segments": segments, "text": "".join([segment["text"] for segment in segments])}
+        inputs = {"preprocessed": lambda: rf.preprocess(data["text"]),
+                  "repetitions": lambda: rf.find_repetitions(data["preprocessed"], preprocessed=True, engine=args.engine),
+                  "patterns": lambda: many_patterns(data["preprocessed"], args.patterns),
+                  "spans": lambda: rf.find_spans(data["preprocessed"], data["repetitions"], preprocessed=True, engine=args.engine)}
+        for key, compute in inputs.items():
+            waiting = [name for name in chosen if name not in too_slow and key in needs.get(name, [])]
+            if len(waiting) == 0: continue
+            started = time.perf_counter()
+            data[key] = compute()
+            if time.perf_counter()-started > args.max_seconds: too_slow.update(waiting)
+
+        for name, stage in chosen.items():
+            if name in too_slow: continue
+            results[name][size] = measure(stage, data, memory=not args.no_memory)
+            if results[name][size]["seconds"] > args.max_seconds: too_slow.add(name)
+            print(f"{name:>24} {size:>10} chars: {results[name][size]['seconds']:10.4f} s", file=sys.stderr)
+        if reference != None and size <= parse_size(args.check_up_to):
+            mismatches[size] = compare(reference, data, args.engine)
+
+    print(f"\n{'stage':>24}" + "".join(f"{size:>12}" for size in sizes) + f"{'exponent':>10}")
+    for name, by_size in results.items():
+        times = "".join(f"{by_size[size]['seconds']:>11.4f}s" if size in by_size else f"{'-':>12}" for size in sizes)
+        print(f"{name:>24}{times}{growth_exponent([(size, result['seconds']) for size, result in by_size.items()]):>10.2f}")
+        if not args.no_memory:
+            memory = "".join(f"{by_size[size]['peak_mb']:>10.2f}MB" if size in by_size else f"{'-':>12}" for size in sizes)
+            print(f"{'peak memory':>24}{memory}")
+    if reference != None:
+        print()
+        for size, names in mismatches.items():
+            print(f"{size:>10} chars: " + ("same as " + args.reference if len(names) == 0 else "different from " + args.reference + ": " + ", ".join(names)))
+
+    if args.json != None:
+        with open(args.json, "w", encoding="utf-8") as file:
+            json.dump({"arguments": vars(args), "results": {name: {str(size): result for size, result in by_size.items()} for name, by_size in results.items()},
+                       "exponents": {name: growth_exponent([(size, result["seconds"]) for size, result in by_size.items()]) for name, by_size in results.items()},
+                       "mismatches": {str(size): names for size, names in mismatches.items()}}, file, indent=2)
+    return 1 if any(mismatches.values()) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
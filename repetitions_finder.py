@@ -1,10 +1,18 @@
-#pip install nltk
+#pip install numpy (only needed for engine="numpy")
 
-from nltk.util import ngrams #for creating n-grams
-from textwrap import wrap    #for separateing words into n-characters long pieces
+from bisect import bisect_left, bisect_right #for finding which word or segment a position belongs to
+from functools import partial #for passing parameters to worker processes
 import unicodedata           #for finding rare punctuation
-import copy                  #for making a capy of the json without changing the original (yes, it was a problem)
 import re                    #for finding instances of repetitions in texts
+import argparse, glob, json, os, sys, time #for cleaning files from the command line
+import mmap                  #for reading large text files window by window without loading them
+import hashlib, sqlite3      #for caching the found repetitions by the text, also on disk
+from collections import OrderedDict, deque #for forgetting the least recently used cached results first, for the latest latencies
+import asyncio               #for serving many cleaning requests at once
+from multiprocessing import Pool #for cleaning many files at once
+from itertools import chain, islice #for giving the lines of a stream to the worker processes in bounded batches
+try: import numpy as np      #for comparing all n-grams at once with engine="numpy"
+except ImportError: np = None
 
 
 
@@ -18,8 +26,12 @@ defaults = {"punctuation_token": "ⓟ",  #a token to replace all punctuation, sh
                                         #inside merged repetitions, will always be at least 3
                                         #allows for words that have 3 repeated letters/syllables inside
             "suspicious_length": 10,    #words longer that this will be checked for repetitions inside
-            "n_grams_span": (1, 50)}    #the expected lowers and highest amount of words in repetitions
+            "n_grams_span": (1, 50),    #the expected lowers and highest amount of words in repetitions
                                         #flexibly changes later if repetitions close to the highest amount are found
+            "preprocessed": False,      #the text was already passed through preprocess(), do not normalize it again
+            "engine": "ngrams",         #the engine for finding spaced repetitions: "ngrams", "suffix_array" or "numpy"
+            "cache": None,              #a RepetitionCache to keep the found repetitions and spans of the analyzed texts
+            "stats": None}              #a RepetitionStats to record the time spent in every stage and the work done there
 
 #AVAILABLE COLORS
 #Motivation: pretty
@@ -29,34 +41,149 @@ end_chr, end_len = '\033[0m', 7
 
 
 
+#TRANSLATION TABLES FOR preprocess()
+#Motivation: to replace all punctuation in one str.translate() pass instead of rebuilding the text for every punctuation mark
+#Process: a dictionary that decides for every character the first time it is seen if it is punctuation (all unicode categories beginning with P)
+         #and remembers the decision, so every later lookup is a plain dictionary lookup done by str.translate()
+         #one table is kept for every punctuation token for as long as the module is loaded
+#Example: "oneⓟ one.".translate(_punctuation_table("ⓟ")) -> "oneⓟ oneⓟ"
+class _PunctuationTable(dict):
+    def __init__(self, punctuation_token: str):
+        super().__init__()
+        self.punctuation_token = punctuation_token
+
+    def __missing__(self, code: int) -> str:
+        character = chr(code)
+        self[code] = self.punctuation_token if unicodedata.category(character).startswith('P') else character
+        return self[code]
+
+
+_punctuation_tables = {}
+def _punctuation_table(punctuation_token: str) -> _PunctuationTable:
+    if punctuation_token not in _punctuation_tables: _punctuation_tables[punctuation_token] = _PunctuationTable(punctuation_token)
+    return _punctuation_tables[punctuation_token]
+
+
+
 #PREPROCESSING TEXT
 #Motivation: to find repetition even though they are capitalized/have different punctuation sign
 #Process: lowers the given text and replaces every character marked as punctuation in unicode with the punctuation token
-#Asssosiated parameters: punctuation_token
+         #uses the cached translation table of the punctuation token, so the whole text is processed in one pass
+#Asssosiated parameters: punctuation_token, stats
 #Example: "One, one, one." -> "oneⓟ oneⓟ oneⓟ"
 def preprocess(text: str,  **kwargs) -> str:
     kwargs = {**defaults, **kwargs}
     try: punctuation_token = str(kwargs["punctuation_token"])
     except Exception: raise TypeError("punctuation_token can only be a string!")
+    if kwargs["preprocessed"]: return text
+
+    started = time.perf_counter()
+    text = text.lower().translate(_punctuation_table(punctuation_token))
+    if kwargs["stats"] != None: kwargs["stats"].time("preprocess", started)
+    return text
+
+
+
+#UTILITY FUNCTIONS FOR find_merged_repetitions() AND THE SUFFIX ARRAY ENGINE OF find_spaced_repetitions()
+#Motivation: to compare any two positions of a sequence of characters or words in constant time instead of comparing pieces for every n
+#Process: builds the suffix array of a sequence of integers by prefix doubling, its LCP array by Kasai's algorithm
+         #and a sparse table over the LCP array, so the longest common extension of two positions is one range minimum
+         #for every period p, only the positions 0, p, 2p, ... are checked, since every run of p-long pieces contains one of them
+         #from such a position q, the run is extended forward with lce(q, q+p) and backward with the same function on the reversed sequence
+         #the positions inside an already extended run are skipped
+         #a run found again with a multiple of its period is skipped ("la la" is not recorded if "la" was)
+         #O(N log N) extensions are computed in total
+#Example: _longest_common_extension([1, 2, 1, 2, 1, 2]) -> lce, lce(0, 2) -> 4
+         #_find_runs([1, 2, 1, 2, 1, 2, 3], 1, 3, 2) -> [(2, 0, 6)]  #(period, start, end)
+def _suffix_array(sequence: list) -> (list, list):
+    length = len(sequence)
+    suffixes, rank = list(range(length)), list(sequence)
+    k = 1
+    while length > 1:
+        key = lambda i: (rank[i], rank[i+k] if i+k < length else -1)
+        suffixes.sort(key=key)
+        new_rank = [0]*length
+        for j in range(1, length):
+            new_rank[suffixes[j]] = new_rank[suffixes[j-1]] + (key(suffixes[j]) != key(suffixes[j-1]))
+        rank = new_rank
+        #all suffixes are already told apart
+        if rank[suffixes[-1]] == length-1: break
+        k *= 2
+    if length == 1: rank = [0]
+    return suffixes, rank
+
+
+def _longest_common_extension(sequence: list):
+    length = len(sequence)
+    suffixes, rank = _suffix_array(sequence)
     
-    preprocessed_text = text.lower()
-    for i, character in enumerate(preprocessed_text):
-        #all categories for punctuation in unicode begin with P
-        if unicodedata.category(character).startswith('P'): 
-            #replace() does not work with some rare characters
-            preprocessed_text = preprocessed_text[:i] + punctuation_token + preprocessed_text[i+1:] 
-            
-    return preprocessed_text
+    #lcp[r] is the length of the common prefix of the suffixes ranked r-1 and r
+    lcp, h = [0]*length, 0
+    for i in range(length):
+        if rank[i] > 0:
+            j = suffixes[rank[i]-1]
+            while i+h < length and j+h < length and sequence[i+h] == sequence[j+h]: h += 1
+            lcp[rank[i]] = h
+            if h > 0: h -= 1
+        else: h = 0
+
+    #table[k][r] is the minimum of lcp[r:r+2**k]
+    table = [lcp]
+    while 2**len(table) <= length:
+        previous, half = table[-1], 2**(len(table)-1)
+        table.append([min(previous[r], previous[r+half]) for r in range(length-2*half+1)])
+
+    def lce(i: int, j: int) -> int:
+        if i == j: return length-i
+        low, high = sorted((rank[i], rank[j]))
+        k = (high-low).bit_length()-1
+        return min(table[k][low+1], table[k][high-2**k+1])
+
+    return lce
+
+
+def _find_runs(sequence: list, p_min: int, p_max: int, min_repetitions: int) -> list:
+    length = len(sequence)
+    if length == 0: return []
+    forward = _longest_common_extension(sequence)
+    backward = _longest_common_extension(sequence[::-1])
+
+    runs, found_extents = [], set()
+    for p in range(max(p_min, 1), min(p_max, length//max(min_repetitions, 1))+1):
+        q = 0
+        while q < length-p:
+            after = forward(q, q+p)
+            before = backward(length-q, length-q-p) if q > 0 else 0
+            start, end = q-before, q+p+after
+            if end-start >= min_repetitions*p and (start, end) not in found_extents:
+                found_extents.add((start, end))
+                runs.append((p, start, end))
+            #the next run with the same period overlaps this one by less than p, skipping the checks inside this one
+            q += (after//p+1)*p
+                
+    return sorted(runs)
+
+
+
+#UTILITY FUNCTION FOR find_merged_repetitions() AND find_repetitions()
+#Motivation: to not search for the same repetition twice in different phases
+#Example: "al", ["la"] -> True
+         #"lal", ["la"] -> False
+def _is_rotation(repetition: str, repetitions: list) -> bool:
+    return any(len(found) == len(repetition) and repetition in found+found for found in repetitions)
 
 
 
 #FINDING REPETITIONS INSIDE WORDS
 #Motivation: to find repetitions merged into one word
-#Process: finds words longer than suspicious_length, separates them into n-characters long pieces
-         #checks if the pieces match each other, adds them to repetitions, repeats with a n+1
-         #all instances of found_repetition*3 are removed from the local text to avoid later detection
+#Process: finds words longer than suspicious_length and joins them into one sequence of characters, separated by unique markers
+         #finds all runs of at least allow_repetitions same pieces inside the words with _find_runs() in one pass
+         #the last piece of every run is the repetition, runs can start anywhere in a word ("yeshahahaha" -> "ha")
+         #taking the last piece keeps the phase of the syllable at the end of the word ("nalalala" and "wolalala" both give "la")
          #for "lalalalalalalala", if "la" was already found, we do not need to find "lala"
-#Asssosiated parameters: suspicious_length, allow_repetitions, preprocess() parameters
+         #the repetitions are ordered by the word they are found in and then by their length
+         #a rotation of an already found repetition is skipped with _is_rotation(), as searching both would pad the characters between them
+#Asssosiated parameters: suspicious_length, allow_repetitions, stats, preprocess() parameters
 #Example: "AaaaaaabbbbCDCDCDCD. eeeee" -> ["a", "b", "cd"]  #no "e" because the len("eeeee")<suspicious_length
 def find_merged_repetitions(text: str, **kwargs) -> list:
     kwargs = {**defaults, **kwargs}
@@ -66,34 +193,149 @@ def find_merged_repetitions(text: str, **kwargs) -> list:
     except Exception: raise TypeError("allow_repetitions can only be an integer!")
     if allow_repetitions < 4: allow_repetitions = 4 #always >3 so words with triple of the same letter (e.g. "Schifffahrt") are not detected
     text = preprocess(text, **kwargs)
+    started, stats = time.perf_counter(), kwargs["stats"]
     
-    #a utility function
-    def check_for_repetitions(long_word):
-        repetitions = []
-        #splitting the word into n-character-long pieces
-        for n in range(1, len(long_word)//allow_repetitions):
-            parts = wrap(long_word, n)
-            #if a few (allow_repetitions) pieces in a row are the same, adding them to repetitions
-            for j in range(len(parts)-allow_repetitions):                    
-                if parts[j] not in repetitions and len(set([parts[j+k] for k in range(allow_repetitions)]))==1:
-                    repetitions.append(parts[j])
-                    #removing chains of repetitions locally to avoid later detection
-                    long_word=long_word.replace(parts[j]*3, "")
-                    
-        return(repetitions)
-        
-    #the primary function continues
-    repetitions = []
     #only checking words longer that suspicious_length
     words = [word for word in text.split() if len(word)>suspicious_length]
-    for word in words:
-        repetition = check_for_repetitions(word)
-        repetitions.extend([i for i in repetition if i not in repetitions])
+    if len(words) == 0:
+        if stats != None: stats.time("find_merged_repetitions", started)
+        return []
+    #the markers are beyond the unicode range, so the runs never cross from one word into another
+    sequence, word_starts = [], []
+    for i, word in enumerate(words):
+        word_starts.append(len(sequence))
+        sequence.extend(map(ord, word))
+        sequence.append(0x110000+i)
+    joined = "".join([word+" " for word in words])
+    
+    runs = _find_runs(sequence, 1, max(map(len, words))//allow_repetitions, allow_repetitions)
+    repetitions = []
+    for _, p, end in sorted((bisect_right(word_starts, start), p, end) for p, start, end in runs):
+        repetition = joined[end-p:end]
+        if not _is_rotation(repetition, repetitions): repetitions.append(repetition)
         
+    if stats != None:
+        stats.time("find_merged_repetitions", started)
+        stats.count("merged_repetitions", len(repetitions))
     return repetitions
 
 
 
+#SUFFIX ARRAY ENGINE OF find_spaced_repetitions()
+#Motivation: to find repetitions in long texts without rebuilding and rescanning n-grams for every n
+#Process: interns the words and finds all runs of at least allow_repetitions same word pieces with _find_runs()
+         #the first piece of every run is the repetition, there is no upper limit on the number of words in a repetition
+#Asssosiated parameters: given by the find_spaced_repetitions() function
+#Example: ["one", "two", "one", "two", "one", "two"], 1, 2 -> ["one two"]
+def _find_spaced_repetitions_suffix_array(words: list, n_min: int, allow_repetitions: int) -> list:
+    ids = {}
+    sequence = [ids.setdefault(word, len(ids)) for word in words]
+    runs = _find_runs(sequence, n_min, len(sequence), allow_repetitions)
+
+    repetitions = []
+    for p, start, _ in runs:
+        repetition = " ".join(words[start:start+p])
+        if repetition not in repetitions: repetitions.append(repetition)
+    return repetitions
+
+
+
+#UTILITY FUNCTION FOR THE NUMPY ENGINE
+#Motivation: to turn the words of a text into numbers, so they can be compared all at once
+#Process: splits the preprocessed text into words, gives every distinct word an id and keeps the character span of every word
+         #analyze() gives the detection and find_spans() the same empty dict as interned, the first of them fills it and the second reuses it,
+         #the dict lives only as long as that one analysis, so no text stays in memory after it
+#Example: "la la lo" -> (["la", "la", "lo"], {"la": 0, "lo": 1}, array([0, 0, 1]), array([0, 3, 6]), array([2, 5, 8]), "\nla\nlo\n")
+def _intern_words(text: str, interned: dict=None) -> tuple:
+    if np == None: raise ImportError('engine="numpy" requires numpy, install it with "pip install numpy"')
+    if interned != None and interned.get("text") == text: return interned["words"]
+    matches = list(re.finditer(r"\S+", text))
+    words = [match.group() for match in matches]
+    vocabulary = {}
+    ids = np.array([vocabulary.setdefault(word, len(vocabulary)) for word in words], dtype=np.int32)
+    starts = np.array([match.start() for match in matches], dtype=np.int64)
+    ends = np.array([match.end() for match in matches], dtype=np.int64)
+    #one line per distinct word, for searching for repetitions inside other words
+    lines = "\n"+"\n".join(vocabulary)+"\n"
+    if interned != None: interned.update(text=text, words=(words, vocabulary, ids, starts, ends, lines))
+    return words, vocabulary, ids, starts, ends, lines
+
+
+#UTILITY FUNCTION FOR THE NUMPY ENGINE
+#Motivation: to find the starts and ends of the runs of True in a boolean array without a Python loop
+#Example: [True, True, False, True] -> (array([0, 3]), array([2, 4]))
+def _true_runs(mask) -> tuple:
+    changes = np.diff(np.concatenate(([0], mask.view(np.int8), [0])))
+    return np.flatnonzero(changes == 1), np.flatnonzero(changes == -1)
+
+
+
+#NUMPY ENGINE OF find_spaced_repetitions()
+#Motivation: to compare all n-grams of a given size at once instead of comparing tuples of strings one by one
+#Process: for every n, ids[:-n] == ids[n:] marks the words equal to the word n positions later
+         #n-grams i and i+n are equal when n such marks in a row are set, so allow_repetitions pieces in a row need (allow_repetitions-1)*n marks
+         #the runs of marks are found with one np.diff, the first n-gram of every long enough run is a repetition
+         #a run found again with a multiple of its n is skipped ("la la" is not recorded if "la" was)
+         #checks the same n-gram sizes as the "ngrams" engine
+#Asssosiated parameters: given by the find_spaced_repetitions() function
+#Example: "one two one two one two", 1, 50, 2 -> ["one two"]
+def _find_spaced_repetitions_numpy(text: str, n: int, n_max: int, allow_repetitions: int, stats=None, interned: dict=None) -> list:
+    words, _, ids, _, _, _ = _intern_words(text, interned)
+    
+    repetitions, found_extents = [], set()
+    while n < n_max or (len(repetitions) > 0 and n < len(repetitions[-1].split()) * 2):
+        if n >= len(ids): break
+        run_starts, run_ends = _true_runs(ids[:-n] == ids[n:])
+        long_enough = run_ends-run_starts >= (allow_repetitions-1)*n
+        for start, end in zip(run_starts[long_enough].tolist(), run_ends[long_enough].tolist()):
+            if (start, end+n) in found_extents: continue
+            found_extents.add((start, end+n))
+            repetition = " ".join(words[start:start+n])
+            if repetition not in repetitions: repetitions.append(repetition)
+        n += 1
+        
+    if stats != None: stats.highest("highest_n", n-1)
+    return repetitions
+
+
+#UTILITY FUNCTION FOR find_spans() WITH THE NUMPY ENGINE
+#Motivation: to find the spans of a repetition made of whole words using the word ids instead of searching the text
+#Process: marks every word where all words of the repetition follow, one space apart, keeps the occurrences that do not overlap
+         #like re.finditer(), the last word only has to start with the last word of the repetition ("two" matches "twoⓟ")
+         #merges occurrences that follow one another with at most one character between them
+         #the text search could also find the repetition inside other words: after the end of a word for longer repetitions ("xtwo two"),
+         #anywhere but at the start of a word for one word repetitions ("nalala" for "la"), then None is returned and the text is searched
+#Example: "twoⓟ twoⓟ twoⓟ", "twoⓟ" -> [(0, 14)]
+         #"two two two two xtwo two two", "two" -> None
+def _find_word_spans(interned: tuple, rep: str) -> list:
+    words, vocabulary, ids, starts, ends, lines = interned
+    rep_words = rep.split()
+    if len(rep_words) == 0 or " ".join(rep_words) != rep: return None
+    inside = ("[^\n]"+re.escape(rep_words[0])+("\n" if len(rep_words) > 1 else ""))
+    if re.search(inside, lines): return None
+    n = len(rep_words)
+    if any(word not in vocabulary for word in rep_words[:-1]) or n > len(ids): return []
+    
+    matches = np.ones(len(ids)-n+1, dtype=bool)
+    single_spaces = starts[1:]-ends[:-1] == 1
+    for k, word in enumerate(rep_words[:-1]):
+        matches &= ids[k:len(ids)-n+1+k] == vocabulary[word]
+        matches &= single_spaces[k:len(ids)-n+1+k]
+    last_ids = [i for word, i in vocabulary.items() if word.startswith(rep_words[-1])]
+    matches &= np.isin(ids[n-1:], last_ids)
+        
+    rep_spans, last_word = [], -n
+    for i in np.flatnonzero(matches).tolist():
+        if i < last_word+n: continue
+        start, end = int(starts[i]), int(starts[i+n-1])+len(rep_words[-1])
+        if rep_spans and i == last_word+n and start-rep_spans[-1][1] <= 1: rep_spans[-1] = (rep_spans[-1][0], end)
+        else: rep_spans.append((start, end))
+        last_word = i
+        
+    return rep_spans
+
+
+
 #FINDING REPETITIONS THAT ARE WORDS
 #Motivation: to find repetitions sequences of one or more words
 #Process: separates text into n-grams, checks if the n-grams match each other, adds them to repetitions, repeats with a n+1
@@ -105,7 +347,10 @@ def find_merged_repetitions(text: str, **kwargs) -> list:
          #e.g., for the repetition ("one", "two", "three"), ("two", "three", "one") and ("three", "one", "two") are the shifts
          #all instances of found_repetition*2 are removed from the local text to avoid later detection
          #for "la la la la la la", if "la" was already found, we do not need to find "la la"
-#Asssosiated parameters: n_grams_span, allow_repetitions, preprocess() parameters
+         #with engine="suffix_array", _find_spaced_repetitions_suffix_array() is used instead and n_max is not needed
+         #with engine="numpy", _find_spaced_repetitions_numpy() is used instead
+         #with stats, the time spent building and scanning the n-grams, the restarts, the n-grams compared and the highest n are recorded
+#Asssosiated parameters: n_grams_span, allow_repetitions, engine, stats, preprocess() parameters
 #Example: "One, two, one, two, one, two." -> ["oneⓟ, twoⓟ"] 
 def find_spaced_repetitions(text=str, **kwargs) -> list:
     kwargs = {**defaults, **kwargs}
@@ -113,15 +358,31 @@ def find_spaced_repetitions(text=str, **kwargs) -> list:
     if type(n) != int or type(n_max) != int or n_max-n < 0:
           raise TypeError("n_gram_span can only be an integer!")
     allow_repetitions = kwargs["allow_repetitions"]
+    engine = kwargs["engine"]
+    if engine not in ("ngrams", "suffix_array", "numpy"): raise TypeError('engine can only be "ngrams", "suffix_array" or "numpy"!')
     text = preprocess(text, **kwargs)
+    started, stats = time.perf_counter(), kwargs["stats"]
+    if engine == "suffix_array": repetitions = _find_spaced_repetitions_suffix_array(text.split(), n, allow_repetitions)
+    elif engine == "numpy": repetitions = _find_spaced_repetitions_numpy(text, n, n_max, allow_repetitions, stats, kwargs.get("_interned"))
+    if engine != "ngrams":
+        if stats != None:
+            stats.time("find_spaced_repetitions", started)
+            stats.count("spaced_repetitions", len(repetitions))
+        return repetitions
     
     repetitions = []
+    restarts, comparisons = 0, 0
     #n-gram sizes of >50< or >(biggest found repetition) * 2<
     while n < n_max or (len(repetitions) > 0 and n < len(repetitions[-1].split()) * 2):
         #spliting text n_grams, adding padding at the end
-        n_grams = list(ngrams(text.split(), n))+n*[""]
+        if stats != None: n_started = time.perf_counter()
+        words = text.split()
+        n_grams = list(zip(*[words[i:] for i in range(n)]))+n*[""]
         #since we are comparing to future n_grams, cut_off allows us to not go out of bounds with indices
         cut_off = n*allow_repetitions
+        if stats != None:
+            stats.time("building_n_grams", n_started)
+            n_started = time.perf_counter()
 
         #restarting the algorythm to avoid double or cross detection of repetitions
         restart = True
@@ -147,8 +408,18 @@ def find_spaced_repetitions(text=str, **kwargs) -> list:
                 #once the last n-gram is reached, we can move to the next n-gram size
                 if i == border-1:
                     restart = False
+            #counted once per pass instead of once per n-gram, so the loop is not slowed down
+            comparisons += i+1
+            restarts += restart
+        if stats != None: stats.time("scanning_n_grams", n_started)
         n+=1
         
+    if stats != None:
+        stats.time("find_spaced_repetitions", started)
+        stats.count("restarts", restarts)
+        stats.count("comparisons", comparisons)
+        stats.highest("highest_n", n-1)
+        stats.count("spaced_repetitions", len(repetitions))
     return repetitions
 
 
@@ -159,69 +430,386 @@ def find_spaced_repetitions(text=str, **kwargs) -> list:
 #Asssosiated parameters: find_spaced_repetitions() parameters, find_merged_repetitions() parameters
 #Example: "One, two, one, two, one, two." -> ["oneⓟ, twoⓟ"] 
 def find_repetitions(text=str, **kwargs) -> list:
-    repetitions = find_spaced_repetitions(text, **kwargs)+find_merged_repetitions(text, **kwargs)
+    #preprocessing once for both detectors
+    text = preprocess(text, **kwargs)
+    kwargs = {**kwargs, "preprocessed": True}
+    if not has_repetitions(text, **kwargs):
+        if kwargs.get("stats") != None: kwargs["stats"].count("screened_out")
+        return []
+    repetitions = find_spaced_repetitions(text, **kwargs)
+    #a merged repetition can be a rotation of a spaced one ("la la la" and "nalalala")
+    repetitions += [rep for rep in find_merged_repetitions(text, **kwargs) if not _is_rotation(rep, repetitions)]
     return repetitions
 
 
+
+#UTILITY FUNCTION FOR has_repetitions()
+#Motivation: to rule out runs of at least a few same pieces in one pass, without finding them
+#Process: for every item, calculates the distance to its previous occurence
+         #in a run of copies same pieces of length p, the last (copies-1)*p items are all at most p away from their previous occurence
+         #so for every item, the longest stretch around it where no distance is bigger than its own is found with two monotonic stacks
+         #if no stretch is at least (copies-1) times as long as that distance (and p_min), there is no such run
+#Example: [1, 2, 1, 2, 3], 1, 2 -> True
+         #[1, 2, 3, 1, 2], 1, 2 -> False
+def _may_have_runs(sequence: list, p_min: int, copies: int) -> bool:
+    length = len(sequence)
+    last_seen, distances = {}, []
+    for j, item in enumerate(sequence):
+        distances.append(j-last_seen[item] if item in last_seen else length+1)
+        last_seen[item] = j
+        
+    #the nearest bigger distance on the left and on the right of every item
+    left, right, stack = [-1]*length, [length]*length, []
+    for j in range(length):
+        while stack and distances[stack[-1]] < distances[j]: right[stack.pop()] = j
+        stack.append(j)
+    stack = []
+    for j in range(length-1, -1, -1):
+        while stack and distances[stack[-1]] < distances[j]: left[stack.pop()] = j
+        stack.append(j)
+        
+    return any(distances[j] <= length and right[j]-left[j]-1 >= (copies-1)*max(distances[j], p_min) for j in range(length))
+
+
+
+#QUICK CHECK FOR REPETITIONS
+#Motivation: to skip the detection for the most texts, which have no repetitions at all
+#Process: checks if the words could contain allow_repetitions same n-grams in a row and if the long words could contain
+         #max(allow_repetitions, 4) same pieces in a row, with _may_have_runs()
+         #never misses a text where find_spaced_repetitions() or find_merged_repetitions() would find something
+         #but can let through some texts where they find nothing
+#Asssosiated parameters: n_grams_span, allow_repetitions, suspicious_length, preprocess() parameters
+#Example: "One, two, one, two, one, two." -> True
+         #"One, two, three." -> False
+def has_repetitions(text: str, **kwargs) -> bool:
+    kwargs = {**defaults, **kwargs}
+    n, n_max = kwargs["n_grams_span"]
+    if type(n) != int or type(n_max) != int or n_max-n < 0:
+          raise TypeError("n_gram_span can only be an integer!")
+    try: suspicious_length = int(kwargs["suspicious_length"])
+    except Exception: raise TypeError("suspicious_length can only be an integer!")
+    allow_repetitions = kwargs["allow_repetitions"]
+    text = preprocess(text, **kwargs)
+    started = time.perf_counter()
+    
+    words = text.split()
+    if allow_repetitions < 2: found = len(words) > 0
+    else: found = _may_have_runs(words, n, allow_repetitions)
+    if not found:
+        #the words are separated by numbers, which never match a character
+        characters = []
+        for i, word in enumerate(words):
+            if len(word) > suspicious_length: characters.extend(list(word)+[i])
+        found = _may_have_runs(characters, 1, max(allow_repetitions, 4))
+    if kwargs["stats"] != None: kwargs["stats"].time("has_repetitions", started)
+    return found
+
+
     
+#UTILITY FUNCTION FOR find_spans()
+#Motivation: to find the occurences of all repetitions with the regex engine instead of comparing them in python at every position
+#Process: every pattern is escaped and searched with its own re.finditer(), so the whole search of a pattern runs in C
+         #like re.finditer(), the occurences of every pattern do not overlap each other
+#Example: "eee two eee", ["ee", "two"] -> {"ee": [(0, 2), (8, 10)], "two": [(4, 7)]}
+def _find_occurences(text: str, patterns: list) -> dict:
+    patterns = list(dict.fromkeys(pattern for pattern in patterns if pattern != ""))
+    return {pattern: [match.span() for match in re.finditer(re.escape(pattern), text)] for pattern in patterns}
+
+
+#UTILITY FUNCTION FOR find_spans()
+#Motivation: to merge the occurences of a repetition that follow one another without restarting after every merge
+#Process: sorts the spans once and merges every span that starts right after or one character after the previous one ends
+         #the spans that were not merged come first and the merged spans after them, in the order they appear in the text
+#Example: [(0, 2), (3, 5), (10, 12)] -> [(10, 12), (0, 5)]
+def _merge_spans(rep_spans: list) -> list:
+    merged = []
+    for span in sorted(rep_spans):
+        if merged and (merged[-1][1] == span[0] or merged[-1][1]+1 == span[0]):
+            merged[-1] = [merged[-1][0], span[1], True]
+        else: merged.append([span[0], span[1], False])
+        
+    return [(start, end) for start, end, was_merged in merged if not was_merged]+[(start, end) for start, end, was_merged in merged if was_merged]
+
+
+
 #FIND THE START END END OF EACH REPETITION
 #Motivation: to find the starts and ends of all repetition clusters that are longer than allow_repetitions
-#Process: for each repetition, finds the spans of it occuring in the text
-         #if the spans follow one another, they are merged into a bigger span
+#Process: finds the spans of all repetitions occuring in the text with _find_occurences()
+         #if the spans follow one another, they are merged into a bigger span with _merge_spans()
          #the end results spans are bigger then allow_repetitions*len(repetition)
          #repetitions and their end result spans are added to the dictionary as a key-value pair if the spans arent empty
          #for repetitions < 4 characters long occuring inside words, there exists a lot of single occurences, which slow down the process
          #in such cases, the model looks for the pairs of such repetitions in a row and then adds the odd last repetition to the span if such exists
-#Asssosiated parameters: allow_repetitions, repetitions (makes new if none is given), find_repetitions() parameters
+         #with engine="numpy", repetitions that can only occur as whole words are found with _find_word_spans() instead
+         #with stats, the occurences found, the merges of following occurences and the spans given back are counted
+#Asssosiated parameters: allow_repetitions, repetitions (makes new if none is given), engine, stats, find_repetitions() parameters
 #Example: "Oneeeeeeeeee. Two, two, two. Threeeeeeeeeeeeee!" -> {'twoⓟ': [(14, 28)], 'e': [(2, 12), (32, 46)]}
 def find_spans(text: str, repetitions: list=None, **kwargs) -> dict:
     kwargs = {**defaults, **kwargs}
     try: allow_repetitions = kwargs["allow_repetitions"]
     except Exception: raise TypeError("allow_repetitions can only be an integer!")
     text = preprocess(text, **kwargs)
-    if repetitions == None: repetitions = find_repetitions(text, **kwargs)
+    if repetitions == None: repetitions = find_repetitions(text, **{**kwargs, "preprocessed": True})
+    started, stats = time.perf_counter(), kwargs["stats"]
         
-    spans = {}
+    spans, occurences_found, merges = {}, 0, 0
     
-    #finding all instances of a repetition occuring
+    #choosing what to look for: the repetition itself or, for short ones, the repetition twice in a row
+    patterns, word_spans = {}, {}
+    interned = _intern_words(text, kwargs.get("_interned")) if kwargs["engine"] == "numpy" and len(repetitions) != 0 else None
     for rep in repetitions:
+        rep_spans = _find_word_spans(interned, rep) if interned != None else None
+        if rep_spans != None:
+            word_spans[rep] = rep_spans
+            continue
         #helps speed up short string checking
-        if len(rep) < 4 and " "+rep+" "+rep not in text:
-            rep_spans = [i.span() for i in re.finditer(rep*2, text)]
-            span_starts = [i[0] for i in rep_spans]
+        patterns[rep] = rep*2 if len(rep) < 4 and " "+rep+" "+rep not in text else rep
+    occurences = _find_occurences(text, list(patterns.values()))
+    
+    #finding all instances of a repetition occuring
+    for rep in repetitions:
+        if rep in word_spans:
+            rep_span = [span for span in word_spans[rep] if (span[1]-span[0])//len(rep)>allow_repetitions]
+            if len(rep_span) != 0: spans[rep] = rep_span
+            continue
+        rep_spans = occurences.get(patterns[rep], [])
+        if patterns[rep] != rep:
+            span_starts = set(i[0] for i in rep_spans)
             rep_spans = [(span[0], span[1]+len(rep)) if span[1] not in span_starts and text[span[1]:span[1]+len(rep)]==rep else span for span in rep_spans]
-        else:
-            rep_spans = [i.span() for i in re.finditer(rep, text)]
-            
-        #restarting the algorithm after merging a span to see the bigger picture
-        for restart in range(len(rep_spans)+1):
-            #checking if a span and a span after it come right after another
-            for i in range(len(rep_spans)-1):
-                rs = sorted(rep_spans)
-                first, second = rs[i], rs[i+1]
-                first_start, first_end = first[0], first[1]
-                second_start, second_end = second[0], second[1]
-                follow_condition = first_end == second_start or first_end+1 == second_start
-                if follow_condition:
-                    #if two spans follow each other, merge them and remove the original ones
-                    rep_spans.append((first_start, second_end))
-                    rep_spans.remove(first)
-                    rep_spans.remove(second)
-                    break
+        occurences_found, merges = occurences_found+len(rep_spans), merges+len(rep_spans)
+        rep_spans = _merge_spans(rep_spans)
+        merges -= len(rep_spans)
              
         #checking that the found spans are longer than the allowed repetitions amount
         rep_span = [span for span in rep_spans if (span[1]-span[0])//len(rep)>allow_repetitions]
         #assigning valid spans to the repetitions
         if len(rep_span) !=0: spans[rep] = rep_span
                 
+    if stats != None:
+        stats.time("find_spans", started)
+        stats.count("occurences", occurences_found)
+        stats.count("merges", merges)
+        stats.count("spans", sum(len(rep_spans) for rep_spans in spans.values()))
     return spans
 
 
+
+#RESULT OF ANALYZING A TEXT
+#Motivation: to preprocess the text and detect repetitions only once, then reuse the result for padding, cleaning and showcasing
+#Process: keeps the original text, the preprocessed text, the found repetitions and their spans together with the parameters used
+         #pad_text(), clean_text(), clean_segments(), clean() and showcase() accept it instead of the text
+         #the detection parameters stored in the analysis are used, the ones passed later are only used for padding and showing
+         #with a cache, the repetitions and spans of a text seen before are taken from it
+#Asssosiated parameters: cache, find_spans() parameters
+#Example: analysis = analyze("One, two, one, two, one, two.")
+         #analysis.repetitions -> ["oneⓟ twoⓟ"]
+         #analysis.spans -> {"oneⓟ twoⓟ": [(0, 29)]}
+class RepetitionAnalysis:
+    def __init__(self, text: str, preprocessed_text: str, repetitions: list, spans: dict, kwargs: dict):
+        self.text = text
+        self.preprocessed_text = preprocessed_text
+        self.repetitions = repetitions
+        self.spans = spans
+        self.kwargs = kwargs
+
+    def __repr__(self):
+        return f"RepetitionAnalysis(repetitions={self.repetitions!r}, spans={self.spans!r})"
+
+
+def analyze(text: str, **kwargs) -> RepetitionAnalysis:
+    kwargs = {**defaults, **kwargs}
+    cache = kwargs["cache"]
+    if cache != None and not isinstance(cache, RepetitionCache): raise TypeError("cache can only be a RepetitionCache!")
+    if kwargs["stats"] != None and not isinstance(kwargs["stats"], RepetitionStats): raise TypeError("stats can only be a RepetitionStats!")
+    preprocessed_text = preprocess(text, **kwargs)
+    
+    if cache != None:
+        key = cache.key(text, **kwargs)
+        cached = cache.get(key)
+        if cached != None: return RepetitionAnalysis(text, preprocessed_text, *cached, kwargs)
+    #everything down the line works on the already preprocessed text, the numpy engine interns its words once for both stages
+    detection_kwargs = {**kwargs, "preprocessed": True, "_interned": {}}
+    repetitions = find_repetitions(preprocessed_text, **detection_kwargs)
+    spans = find_spans(preprocessed_text, repetitions, **detection_kwargs)
+    if cache != None: cache.put(key, repetitions, spans)
+    return RepetitionAnalysis(text, preprocessed_text, repetitions, spans, kwargs)
+
+
+
+#CACHE FOR THE FOUND REPETITIONS
+#Motivation: to not find the repetitions of the same text again when it is cleaned again, exported again or repeated in another chunk
+#Process: the key is a hash of the text and of the parameters that change what is found
+         #the found repetitions and spans are kept in memory, the least recently used ones are forgotten after max_size texts
+         #if a path is given, they are also kept in an sqlite database there, which can be shared by many processes
+         #the database connection is opened again in every process, so the cache can be passed to worker processes
+         #the number of memory hits, disk hits and misses is given by stats()
+#Asssosiated parameters: given to analyze() as cache
+#Example: cache = RepetitionCache(max_size=10000, path="repetitions.sqlite")
+         #clean(transcript, cache=cache)
+         #cache.stats() -> {"hits": 0, "disk_hits": 0, "misses": 1, "size": 1}
+class RepetitionCache:
+    detection_parameters = ("punctuation_token", "allow_repetitions", "suspicious_length", "n_grams_span", "preprocessed", "engine")
+
+    def __init__(self, max_size: int=1024, path: str=None):
+        if type(max_size) != int or max_size < 0: raise TypeError("max_size can only be a non-negative integer!")
+        self.max_size = max_size
+        self.path = path
+        self.memory = OrderedDict()
+        self.hits, self.disk_hits, self.misses = 0, 0, 0
+        self.connection, self.connection_pid = None, None
+
+    def __getstate__(self) -> dict:
+        return {"max_size": self.max_size, "path": self.path}
+
+    def __setstate__(self, state: dict):
+        self.__init__(**state)
+
+    def key(self, text: str, **kwargs) -> str:
+        kwargs = {**defaults, **kwargs}
+        parameters = json.dumps([kwargs[parameter] for parameter in self.detection_parameters], ensure_ascii=False)
+        return hashlib.sha256((parameters+"\n"+text).encode("utf-8", "surrogatepass")).hexdigest()
+
+    def _database(self) -> sqlite3.Connection:
+        if self.connection == None or self.connection_pid != os.getpid():
+            self.connection = sqlite3.connect(self.path, timeout=30)
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS repetitions (key TEXT PRIMARY KEY, value TEXT)")
+            self.connection_pid = os.getpid()
+        return self.connection
+
+    def get(self, key: str) -> tuple:
+        if key in self.memory:
+            self.memory.move_to_end(key)
+            self.hits += 1
+            return self._thaw(self.memory[key])
+        if self.path != None:
+            row = self._database().execute("SELECT value FROM repetitions WHERE key = ?", (key,)).fetchone()
+            if row != None:
+                value = json.loads(row[0])
+                result = (value["repetitions"], {rep: [tuple(span) for span in spans] for rep, spans in value["spans"]})
+                self._remember(key, *result)
+                self.disk_hits += 1
+                return result
+        self.misses += 1
+        return None
+
+    def put(self, key: str, repetitions: list, spans: dict):
+        self._remember(key, repetitions, spans)
+        if self.path != None:
+            #the spans are kept as a list of pairs to keep their order
+            value = json.dumps({"repetitions": repetitions, "spans": list(spans.items())}, ensure_ascii=False)
+            with self._database() as database: database.execute("INSERT OR REPLACE INTO repetitions VALUES (?, ?)", (key, value))
+
+    #the results are kept as tuples and given out as new lists, so changing an analysis does not change the cache
+    def _remember(self, key: str, repetitions: list, spans: dict):
+        if self.max_size == 0: return
+        self.memory[key] = (tuple(repetitions), tuple((rep, tuple(tuple(span) for span in rep_spans)) for rep, rep_spans in spans.items()))
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_size: self.memory.popitem(last=False)
+
+    def _thaw(self, result: tuple) -> tuple:
+        return list(result[0]), {rep: list(rep_spans) for rep, rep_spans in result[1]}
+
+    def clear(self):
+        self.memory.clear()
+        if self.path != None:
+            with self._database() as database: database.execute("DELETE FROM repetitions")
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "disk_hits": self.disk_hits, "misses": self.misses, "size": len(self.memory)}
+
+
+
+#COLLECTOR FOR THE WORK DONE IN EVERY STAGE
+#Motivation: to find out which stage is responsible when cleaning a text takes too long
+#Process: the stages add the seconds they took and the number of calls under their name, and their work counters
+         #preprocess, has_repetitions, find_spaced_repetitions (with building_n_grams and scanning_n_grams inside it for the "ngrams" engine),
+         #find_merged_repetitions, find_spans and realign_segments are timed, the stages they call are not included in their time
+         #counted are the restarts, comparisons, spaced_repetitions, merged_repetitions, occurences, merges, spans, changed_segments and
+         #screened_out (texts skipped by has_repetitions()), highest_n is the highest n-gram size reached
+         #the callback, if given, is called with the name and the seconds of every timed stage, e.g. to send them to a metrics system
+         #without stats, the stages only call time.perf_counter() once and check for None, the loops are never slowed down
+#Asssosiated parameters: given to analyze(), clean() and the other functions as stats
+#Example: stats = RepetitionStats()
+         #clean(transcript, stats=stats)
+         #stats.as_dict() -> {"seconds": {"preprocess": 0.0001, "find_spaced_repetitions": 0.05, ...}, "calls": {...}, "counters": {"highest_n": 50, ...}}
+class RepetitionStats:
+    def __init__(self, callback=None):
+        if callback != None and not callable(callback): raise TypeError("callback can only be a function!")
+        self.callback = callback
+        self.seconds, self.calls, self.counters = {}, {}, {}
+
+    def time(self, stage: str, started: float):
+        seconds = time.perf_counter()-started
+        self.seconds[stage] = self.seconds.get(stage, 0.0)+seconds
+        self.calls[stage] = self.calls.get(stage, 0)+1
+        if self.callback != None: self.callback(stage, seconds)
+
+    def count(self, counter: str, value: int=1):
+        self.counters[counter] = self.counters.get(counter, 0)+value
+
+    def highest(self, counter: str, value: int):
+        self.counters[counter] = max(self.counters.get(counter, value), value)
+
+    def clear(self):
+        self.seconds, self.calls, self.counters = {}, {}, {}
+
+    def as_dict(self) -> dict:
+        return {"seconds": dict(self.seconds), "calls": dict(self.calls), "counters": dict(self.counters)}
+
+    def __repr__(self):
+        return f"RepetitionStats({self.as_dict()!r})"
+
+
+
+#UTILITY FUNCTION FOR pad_text(), clean_text() AND find_kept_ranges()
+#Motivation: to build the padded and cleaned texts in one pass instead of rebuilding the whole text for every span
+#Process: for each repetition span, finds the part that gets padded: everything but the first repetition sans its last character
+         #and the last character of the last repetition, if a repetition is one character long, everything but the first character
+         #a span of a longer repetition is left to a one character repetition whose span covers it from inside its first repetition to its end,
+         #as in "Waslalala!" the "a" would pad the kept last character of "la" and the union of both would leave "Wasl!"
+         #sorts and merges the padded parts once and returns the sorted ranges of the text with the action for each of them
+#Example: 35, {'twoⓟ': [(14, 28)], 'e': [(2, 12)]} -> [(0, 3, "keep"), (3, 12, "pad"), (12, 17, "keep"), (17, 27, "pad"), (27, 35, "keep")]
+def _text_ranges(length: int, repetitions_spans: dict) -> list:
+    #the spans of one character repetitions by their starts, with the farthest end reached up to each of them
+    single = sorted([span for rep, spans in repetitions_spans.items() if len(rep) == 1 for span in spans])
+    single_starts, farthest_ends = [span[0] for span in single], []
+    for span in single: farthest_ends.append(max(span[1], farthest_ends[-1] if farthest_ends else 0))
+    
+    padded = []
+    for rep, spans in repetitions_spans.items():
+        for span in spans:
+            if len(rep) > 1:
+                covering = bisect_right(single_starts, span[0]+len(rep)-1)
+                if covering > 0 and farthest_ends[covering-1] >= span[1]: continue
+            start = span[0]+1 #preserving the first character in case its a capital letter
+            end = span[1]-1   #precerving the last character in case its puntuation
+            if len(rep) == 1: padded.append((start, end+1))
+            elif len(rep) == 2: padded.append((start, end))
+            else: padded.append((start+len(rep)-2, end)) #trust me bro
+    
+    ranges, kept_from = [], 0
+    for start, end in sorted(padded):
+        start, end = max(start, kept_from), min(end, length)
+        if end <= start: continue
+        if ranges and ranges[-1][2] == "pad" and ranges[-1][1] == start: ranges[-1] = (ranges[-1][0], end, "pad")
+        else:
+            if kept_from < start: ranges.append((kept_from, start, "keep"))
+            ranges.append((start, end, "pad"))
+        kept_from = end
+    if kept_from < length: ranges.append((kept_from, length, "keep"))
+    
+    return ranges
+
+
+
 #REPLACE REPETITIONS WITH TOKENS
 #Motivation: to mark down the parts of the repetitions to be deleted but keep the original length of the text so indices still work
 #Process: for each repetition span, only preserve the first repetition sans the last character as well as the last character of the last repetition
          #if a repetition is one character long, only the first character
+         #the padded text is joined once from the ranges given by _text_ranges()
 #Asssosiated parameters: replacement_token, repetitions_spans (makes new if none is given), find_spans() parameters
+                        #text can also be a RepetitionAnalysis, then its spans are used
 #Example: original: "Oneeeeeeeeee. Two, two, two. Three!" 
          #spans {'twoⓟ': [(14, 28)], 'e': [(2, 12)]}
          #padded: "Oneⓣⓣⓣⓣⓣⓣⓣⓣⓣ. Twoⓣⓣⓣⓣⓣⓣⓣⓣⓣⓣ. Three!" 
@@ -229,39 +817,44 @@ def pad_text(text:str, repetitions_spans: list=None, **kwargs) -> str:
     kwargs = {**defaults, **kwargs}
     try:replacement_token = kwargs["replacement_token"]
     except Exception: raise TypeError("replacement_token can only be a string!")
-    if repetitions_spans == None: repetitions_spans = find_spans(text, **kwargs)
+    if isinstance(text, RepetitionAnalysis): text, repetitions_spans = text.text, text.spans
+    if repetitions_spans == None: repetitions_spans = analyze(text, **kwargs).spans
 
     #replacing all spans with token characters while only leaving one instance
-    for rep, spans in repetitions_spans.items():
-        for span in spans:
-            start = span[0]+1 #preserving the first character in case its a capital letter
-            end = span[1]-1   #precerving the last character in case its puntuation
-            padding = replacement_token*(end-start-len(rep)+2)
-            if len(rep) == 1: text = text[:start]+padding+text[end+1:]
-            elif len(rep) == 2: text = text[:start]+padding+text[end:]
-            else: text = text[:start+len(rep)-2]+padding+text[end:] #trust me bro
+    return "".join([text[start:end] if action == "keep" else replacement_token*(end-start)
+                    for start, end, action in _text_ranges(len(text), repetitions_spans)])
+
 
-    return text
+
+#FIND THE PARTS OF THE TEXT THAT STAY
+#Motivation: to apply the cleaning to other data aligned with the text without building the padded text
+#Process: returns the sorted (start, end) ranges of the original text that are kept by clean_text()
+#Asssosiated parameters: repetitions_spans (makes new if none is given), find_spans() parameters
+                        #text can also be a RepetitionAnalysis, then its spans are used
+#Example: original: "Oneeeeeeeeee. Two, two, two. Three!" 
+         #kept ranges: [(0, 3), (12, 17), (27, 35)]
+def find_kept_ranges(text: str, repetitions_spans: dict=None, **kwargs) -> list:
+    kwargs = {**defaults, **kwargs}
+    if isinstance(text, RepetitionAnalysis): text, repetitions_spans = text.text, text.spans
+    if repetitions_spans == None: repetitions_spans = analyze(text, **kwargs).spans
+    
+    return [(start, end) for start, end, action in _text_ranges(len(text), repetitions_spans) if action == "keep"]
 
 
 
 #REMOVE REPETITION TOKENS
-#Motivation: to clean out the repetition tokens from the padded text
-#Process: replace repetitions tokens with ""
-#Asssosiated parameters: replacement_token, pad_text() parameters
+#Motivation: to clean out the repetitions from the text
+#Process: joins the kept ranges of the text given by find_kept_ranges(), the padded text is never built
+#Asssosiated parameters: pad_text() parameters (text can also be a RepetitionAnalysis)
 #Example: original: "Oneeeeeeeeee. Two, two, two. Three!" 
          #padded: "Oneⓣⓣⓣⓣⓣⓣⓣⓣⓣ. Twoⓣⓣⓣⓣⓣⓣⓣⓣⓣⓣ. Three!" 
          #cleaned: "One. Two. Three!" 
 def clean_text(text: str, **kwargs) -> str:
     kwargs = {**defaults, **kwargs}
-    try:replacement_token = kwargs["replacement_token"]
-    except Exception: raise TypeError("replacement_token can only be a string!")
+    if not isinstance(text, RepetitionAnalysis): text = analyze(text, **kwargs)
 
-    #removing the padding
-    text = pad_text(text, **kwargs)
-    text = text.replace(replacement_token, "")
-
-    return text
+    #leaving out the padding
+    return "".join([text.text[start:end] for start, end in find_kept_ranges(text, **kwargs)])
 
 
 
@@ -279,12 +872,13 @@ def clean_text(text: str, **kwargs) -> str:
 def clean_words_inside_segments(original: str, padded: str, cleaned:str, token: str) -> (list, list):    
     words_to_stay = []
     indices_to_stay = []
+    cleaned_words = cleaned.split()
     regression_index, start = 0, 0
     for index, word in enumerate(original.split()):
         padded_word = padded[start: start+len(word)]
         if padded_word[0] == token: regression_index+=1
         elif token in padded_word:
-            new_word = cleaned.split()[index-regression_index]
+            new_word = cleaned_words[index-regression_index]
             words_to_stay.append(new_word)
             indices_to_stay.append(index)
         else: 
@@ -298,35 +892,81 @@ def clean_words_inside_segments(original: str, padded: str, cleaned:str, token:
 
 #REMOVE REPETITIONS FROM JSON
 #Motivation: to clean the json files, keep and adjust id, start, end, text and words columns
-#Process: making a deepcopy of the original json to not change it in the future
-         #merging the texts together and padding the resulting sequence
-         #finding index spans for every segment and placing the padded text back accorning to those spans, removing tokens
+#Process: merging the texts together and padding the resulting sequence
+         #finding the segments touched by padding with the start offsets of the segments in the merged text and bisect
+         #placing the padded text back only into those segments, removing tokens
          #cleanind out the words that are no longer present in the segments from "words"
          #adjusting the id distribution so there are no gaps between segments
-#Asssosiated parameters: replacement_token, pad_text() parameters
+         #only the changed segments and their words are copied, the original json is never changed
+         #if analyze() finds nothing to clean, the segments are only normalized the same way without realigning them,
+         #the original segments are given back only when they already have this form
+#Asssosiated parameters: replacement_token, analysis (of the merged segment texts, makes new if none is given), pad_text() parameters
 #Example: original: [{id: 1, "text": "Zerooooooooooooooooooooooooooooo. Oneeeeeeee. Two, two, two. Three!", words: [{"text": "Zerooooooooooooooooooooooooooooo.", "n": 0}, {"text": "Oneeeeeeee.", "n": 1}, {"text": "Two,", "n": 2}, {"text": "two,", "n": 3}, {"text": "two.", "n": 4}, {"text": "Three!", "n": 5}]}]
          #returns: [{id: 0, "text": "Zero. One. Two. Three!", words: [{'text': 'Zero.', 'n': 0}, {'text': 'One.', 'n': 1}, {'text': 'Two.', 'n': 2}, {'text': 'Three!', 'n': 5}]}]
-def clean_segments(segments: list, **kwargs) -> list:
+def clean_segments(segments: list, analysis: RepetitionAnalysis=None, **kwargs) -> list:
     kwargs = {**defaults, **kwargs}
     try:replacement_token = kwargs["replacement_token"]
     except Exception: raise TypeError("replacement_token can only be a string!")
     
     text = "".join([line["text"] for line in segments])
-    text = pad_text(text, **kwargs)
+    #the screening for repetitions is done once, inside find_repetitions()
+    if analysis == None: analysis = analyze(text, **kwargs)
+    elif analysis.text != text: raise ValueError("analysis does not match the text of the segments!")
+    #nothing to clean, only normalizing the segments
+    if len(analysis.spans) == 0: return _normalize_segments(segments)
+    new_segments = _realign_segments(segments, analysis, **kwargs)
+
+    #deleting segments with no text
+    new_segments = [i for i in new_segments if i["text"]!=""]
+    #reassigning the id numbers to avoid spaces
+    for i in range(len(new_segments)): new_segments[i]["id"] = i
+
+    return new_segments
+
+
+#UTILITY FUNCTION FOR clean_segments() AND clean()
+#Motivation: to give back segments of the same form whether something was cleaned or not
+#Process: keeps only id, start, end, text and words of every segment (all columns if one of them is missing), drops the segments with no text
+         #and numbers the ids from 0, the original segments are given back if they already have this form
+#Example: [{"id": 3, "text": " Hi.", "start": 0, "end": 1, "words": [], "tokens": [1]}, {"id": 4, "text": "", ...}] -> [{"id": 0, "start": 0, "end": 1, "text": " Hi.", "words": []}]
+segment_columns = ("id", "start", "end", "text", "words")
+
+def _normalize_segments(segments: list) -> list:
+    complete = all([all([column in i for column in segment_columns]) for i in segments])
+    if all([i["text"] != "" and i.get("id") == n and (not complete or len(i) == len(segment_columns)) for n, i in enumerate(segments)]): return segments
+    new_segments = [{column: i[column] for column in segment_columns} if complete else dict(i) for i in segments if i["text"] != ""]
+    for i in range(len(new_segments)): new_segments[i]["id"] = i
+    return new_segments
+
+
+#UTILITY FUNCTION FOR clean_segments() AND StreamingCleaner
+#Motivation: to place the cleaned text back into the segments while keeping one result for every given segment
+#Process: finds the segments touched by padding and cleans their texts and words, the segments that became empty are kept
+#Asssosiated parameters: given by the clean_segments() function
+def _realign_segments(segments: list, analysis: RepetitionAnalysis, **kwargs) -> list:
+    kwargs = {**defaults, **kwargs}
+    replacement_token = kwargs["replacement_token"]
+    started, stats = time.perf_counter(), kwargs["stats"]
+    text = analysis.text
     try:
-        new_segments = copy.deepcopy([{"id": i["id"], "start": i["start"], "end": i["end"], "text": i["text"], "words": i["words"]} for i in segments])
-    except Exception: new_segments = copy.deepcopy(segments)
+        new_segments = [{"id": i["id"], "start": i["start"], "end": i["end"], "text": i["text"], "words": i["words"]} for i in segments]
+    except Exception: new_segments = [dict(i) for i in segments]
         
     #determining the spans of serments in the original text
-    characters_passed = 0
-    for n, segment in enumerate(new_segments):
+    segment_starts = [0]
+    for segment in new_segments: segment_starts.append(segment_starts[-1]+len(segment["text"]))
+    #finding the segments that have padded characters inside
+    changed = set()
+    for start, end, action in _text_ranges(len(text), analysis.spans):
+        if action == "pad": changed.update(range(bisect_right(segment_starts, start)-1, bisect_left(segment_starts, end)))
+    text = pad_text(analysis, **kwargs) if len(changed) != 0 else text
+    
+    for n in sorted(changed):
+        segment = new_segments[n]
         original_segment_text = segment["text"]
-        currect_last_character = characters_passed+len(segment["text"])
-        segment_span = (characters_passed, currect_last_character)
         #extracting the string matching the span
-        proposed_segment_text_padded = text[segment_span[0]:segment_span[1]]
+        proposed_segment_text_padded = text[segment_starts[n]:segment_starts[n+1]]
         proposed_segment_text_cleaned = proposed_segment_text_padded.replace(replacement_token, "")
-        characters_passed = currect_last_character
 
         if original_segment_text != proposed_segment_text_cleaned:
             #assigning the new text to the segment
@@ -337,41 +977,234 @@ def clean_segments(segments: list, **kwargs) -> list:
                                                                              proposed_segment_text_padded, 
                                                                              proposed_segment_text_cleaned,
                                                                              replacement_token)
-                segment["words"] = [segment["words"][i] for i in indices_to_stay]
-                for i in range(len(segment["words"])):
-                    segment["words"][i]["text"] = words_to_stay[i]
-
-    #deleting segments with no text
-    new_segments = [i for i in new_segments if i["text"]!=""]
-    #reassigning the id numbers to avoid spaces
-    for i in range(len(new_segments)): new_segments[i]["id"] = i
+                segment["words"] = [{**segment["words"][i], "text": word} for i, word in zip(indices_to_stay, words_to_stay)]
 
+    if stats != None:
+        stats.time("realign_segments", started)
+        stats.count("changed_segments", len(changed))
     return new_segments
 
 
+
+#REMOVE REPETITIONS FROM LIVE SEGMENTS
+#Motivation: to clean a growing transcript segment by segment without cleaning everything again after every new segment
+#Process: keeps the segments that are not final yet and, as a context, the last few already emitted ones
+         #the preprocessed text of every segment is kept, so it is only preprocessed once
+         #after every new segment, only the context and the waiting segments are analyzed, their size does not grow with the transcript
+         #a segment is final once it ends before the last (allow_repetitions+1)*n_max words, the longest repetition that is not found yet,
+         #and before the kept last character of every repetition that reaches into those words, as only it can still change
+         #final segments are cleaned like clean_segments() would clean them, the empty ones are dropped and the ids keep counting from 0
+         #repetitions are found inside the context and the waiting segments only, not in the whole transcript
+         #while the window has no repetitions, a new segment can only add one that ends in it and starts at most lookback words before it,
+         #so only that tail is searched and the analysis of the unchanged context is carried over
+         #once the window has repetitions, it is analyzed again as a whole after every new segment until they are emitted,
+         #so a segment still costs a search over about lookback words, not over the new segment only
+#Asssosiated parameters: replacement_token, analyze() parameters
+#Example: cleaner = StreamingCleaner()
+         #for segment in live_segments: send(cleaner.feed(segment))
+         #send(cleaner.flush())
+class StreamingCleaner:
+    def __init__(self, **kwargs):
+        self.kwargs = {**defaults, **kwargs}
+        n, n_max = self.kwargs["n_grams_span"]
+        if type(n) != int or type(n_max) != int or n_max-n < 0:
+            raise TypeError("n_gram_span can only be an integer!")
+        self.lookback = (max(self.kwargs["allow_repetitions"], 1)+1)*n_max
+        #lists of (segment, preprocessed text, number of words)
+        self.context, self.waiting = [], []
+        self.emitted = 0
+        #if the last analyzed window had repetitions in it
+        self.repeated = False
+
+    def feed(self, segment: dict) -> list:
+        preprocessed_text = preprocess(segment["text"], **self.kwargs)
+        self.waiting.append((segment, preprocessed_text, len(preprocessed_text.split())))
+        return self._emit(final=False)
+
+    def flush(self) -> list:
+        return self._emit(final=True)
+
+    def _emit(self, final: bool) -> list:
+        window = self.context+self.waiting
+        segments = [segment for segment, _, _ in window]
+        preprocessed_text = "".join([preprocessed for _, preprocessed, _ in window])
+        detection_kwargs = {**self.kwargs, "preprocessed": True, "_interned": {}}
+        word_starts = [word.start() for word in re.finditer(r"\S+", preprocessed_text)]
+        
+        #searching only the new segment and the lookback words before it, if the window had no repetitions until now
+        new_start = len(preprocessed_text)-(0 if final else len(self.waiting[-1][1]))
+        old_words = bisect_left(word_starts, new_start)
+        tail_start = word_starts[old_words-self.lookback-1] if old_words > self.lookback else 0
+        if not self.repeated and (new_start == len(preprocessed_text) or len(find_repetitions(preprocessed_text[tail_start:], **detection_kwargs)) == 0): repetitions, spans = [], {}
+        else:
+            repetitions = find_repetitions(preprocessed_text, **detection_kwargs)
+            spans = find_spans(preprocessed_text, repetitions, **detection_kwargs)
+        analysis = RepetitionAnalysis("".join([segment["text"] for segment in segments]), preprocessed_text, repetitions, spans, self.kwargs)
+        cleaned = _realign_segments(segments, analysis, **self.kwargs)
+        self.repeated = len(spans) > 0
+        
+        #everything before the boundary cannot be changed by the segments that come later
+        boundary = len(preprocessed_text)
+        if not final:
+            boundary = word_starts[-self.lookback] if len(word_starts) > self.lookback else 0
+            for end in sorted([span[1] for rep_spans in spans.values() for span in rep_spans], reverse=True):
+                if end >= boundary: boundary = min(boundary, end-1)
+        
+        emitted, segment_end = [], sum([len(segment["text"]) for segment, _, _ in self.context])
+        while len(self.waiting) > 0 and segment_end+len(self.waiting[0][0]["text"]) <= boundary:
+            segment_end += len(self.waiting[0][0]["text"])
+            new_segment = cleaned[len(self.context)]
+            if new_segment["text"] != "":
+                new_segment["id"] = self.emitted
+                self.emitted += 1
+                emitted.append(new_segment)
+            self.context.append(self.waiting.pop(0))
+        
+        #only keeping enough of the emitted segments to find the repetitions that continue into the waiting ones
+        while len(self.context) > 1 and sum([words for _, _, words in self.context[1:]]) >= self.lookback: self.context.pop(0)
+            
+        return emitted
+
+
 #CLEAN TEXT OR JSON
 #Motivation: to not always have to search for an appropriate function for your data type
 #Process: detects object type and chooses the appropriate cleaning function
+         #for a json with both "text" and "segments", the text is analyzed only once if it matches the merged segments
+         #the screening for repetitions is done once, inside analyze(), a json is always given back with only "text" and "segments"
+         #and normalized segments, the original object is given back when nothing was cleaned and it already has this form
 #Asssosiated parameters: clean_text() parameters, clean_segments() parameters
 def clean(obj, **kwargs):
-    if type(obj) == str: return clean_text(obj, **kwargs)
+    if type(obj) == str:
+        analysis = analyze(obj, **kwargs)
+        return clean_text(analysis, **kwargs) if len(analysis.spans) > 0 else obj
+    if isinstance(obj, RepetitionAnalysis): return clean_text(obj, **kwargs)
     
     if type(obj) == list: 
         if type(obj[0]) == dict: return clean_segments(obj, **kwargs) 
         
     if type(obj) == dict:
         if "text" in obj and "segments" in obj: 
-            return {"text":clean_text(obj["text"], **kwargs), "segments": clean_segments(obj["segments"], **kwargs)}
+            segments_text = "".join([line["text"] for line in obj["segments"]])
+            analysis = analyze(segments_text, **kwargs)
+            text_analysis = analysis if analysis.text == obj["text"] else analyze(obj["text"], **kwargs)
+            text = clean_text(text_analysis, **kwargs) if len(text_analysis.spans) > 0 else obj["text"]
+            segments = clean_segments(obj["segments"], analysis, **kwargs)
+            #nothing to clean and already in the returned form
+            if len(obj) == 2 and text is obj["text"] and segments is obj["segments"]: return obj
+            return {"text": text, "segments": segments}
             
     #if nothing got returned
     raise TypeError("Only strings or jsons are allowed")
 
 
 
+#UTILITY FUNCTIONS FOR clean_large_file()
+#Motivation: to cut the file only between characters and to turn the positions in a window into positions in the file
+#Example: _character_boundary("aé".encode(), 2) -> 1  #the second byte of "é" is not a character boundary
+         #_byte_offsets("aé b", [0, 2, 4]) -> {0: 0, 2: 3, 4: 5}
+def _character_boundary(data, position: int) -> int:
+    while 0 < position < len(data) and data[position] & 0xC0 == 0x80: position -= 1
+    return position
+
+
+def _byte_offsets(text: str, positions: list) -> dict:
+    offsets, last_position, offset = {}, 0, 0
+    for position in sorted(set(positions)):
+        offset += len(text[last_position:position].encode("utf-8"))
+        offsets[position], last_position = offset, position
+    return offsets
+
+
+
+#CLEAN A LARGE TEXT FILE
+#Motivation: to clean text files too large to be held in memory together with their preprocessed and padded copies
+#Process: memory-maps the utf-8 input and analyzes it in windows of about window_size bytes that end at whitespace
+         #like in StreamingCleaner, the text before the last (allow_repetitions+1)*n_max words of a window and before
+         #the kept last character of every repetition that reaches into them is final, it is cleaned and written to the output right away
+         #the next window starts that many words before the final part, or earlier at the start of a repetition that reaches past it,
+         #so the repetitions crossing the boundary are found again whole, only a repetition longer than window_size is cut
+         #while nothing in a window becomes final (too few words, e.g. text without spaces), the window doubles up to 8*window_size,
+         #after that it is cut at its end, between two characters, even inside a word or a repetition,
+         #a repetition cut this way keeps its last character at every cut ("abababab..." longer than 8 windows -> "abbbbbbb")
+         #the output is written through a temporary file, the spans are written to spans_path as json lines in byte offsets of the input
+         #peak memory depends on window_size, not on the size of the file
+         #repetitions are found inside each window only, not in the whole file, like in StreamingCleaner
+         #so the result can differ from clean_text() of the whole file: a repetition found in one part of a text is searched for
+         #in all of it ("I it" becomes "It" when "i" repeats somewhere else), here only in the same window
+#Asssosiated parameters: window_size, spans_path, analyze() parameters
+#Example: clean_large_file("corpus.txt", "corpus.cleaned.txt", spans_path="corpus.spans.jsonl")
+         #-> {"bytes_read": 5368709120, "bytes_written": 5301123456, "windows": 5120, "spans": 84211}
+         #corpus.spans.jsonl: {"repetition": "thank youⓟ", "start": 1048, "end": 1102}
+def clean_large_file(input_path: str, output_path: str, spans_path: str=None, window_size: int=2**20, **kwargs) -> dict:
+    kwargs = {**defaults, **kwargs}
+    if type(window_size) != int or window_size < 1: raise TypeError("window_size can only be a positive integer!")
+    n, n_max = kwargs["n_grams_span"]
+    if type(n) != int or type(n_max) != int or n_max-n < 0:
+        raise TypeError("n_gram_span can only be an integer!")
+    lookback = (max(kwargs["allow_repetitions"], 1)+1)*n_max
+    whitespace, max_grow = re.compile(rb"\s"), 8
+    report = {"bytes_read": 0, "bytes_written": 0, "windows": 0, "spans": 0}
+    
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    with open(input_path, "rb") as file, open(output_path+".part", "w", encoding="utf-8", newline="") as output:
+        size = os.fstat(file.fileno()).st_size
+        data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) if size > 0 else b""
+        spans_file = open(spans_path, "w", encoding="utf-8") if spans_path != None else None
+        try:
+            #byte offsets of the start of the window and of the text that is not written yet, the window grows while nothing becomes final
+            window_start, done, grow = 0, 0, 1
+            while done < size:
+                window_end = min(size, done+window_size*grow)
+                if window_end < size:
+                    space = whitespace.search(data, window_end, min(size, window_end+window_size))
+                    window_end = space.start() if space != None else _character_boundary(data, window_end)
+                written = data[window_start:done].decode("utf-8")
+                text = written+data[done:window_end].decode("utf-8")
+                analysis = analyze(text, **kwargs)
+                all_spans = [(span[0], span[1], rep) for rep, rep_spans in analysis.spans.items() for span in rep_spans]
+                
+                #everything before the boundary cannot be changed by the text that comes later
+                boundary, next_start = len(text), len(text)
+                if window_end < size:
+                    word_starts = [word.start() for word in re.finditer(r"\S+", analysis.preprocessed_text)]
+                    boundary = word_starts[-lookback] if len(word_starts) > lookback else 0
+                    for end in sorted([end for _, end, _ in all_spans], reverse=True):
+                        if end >= boundary: boundary = min(boundary, end-1)
+                    if boundary <= len(written) and grow < max_grow:
+                        grow *= 2
+                        continue
+                    #the window cannot grow anymore, cutting it at its end
+                    if boundary <= len(written): boundary = len(text)
+                    first_word = bisect_right(word_starts, boundary)-1
+                    next_start = min([word_starts[max(first_word-lookback, 0)] if first_word >= 0 else boundary]+
+                                     [start for start, end, _ in all_spans if end > boundary])
+                    next_start = max(next_start, boundary-window_size, 0)
+                
+                for start, end in find_kept_ranges(analysis):
+                    if end > len(written) and start < boundary: output.write(text[max(start, len(written)):min(end, boundary)])
+                #every span is reported by the window where it becomes final
+                spans = sorted(span for span in all_spans if len(written) < span[1] <= boundary)
+                offsets = _byte_offsets(text, [boundary, next_start]+[start for start, _, _ in spans]+[end for _, end, _ in spans])
+                if spans_file != None:
+                    for start, end, rep in spans:
+                        spans_file.write(json.dumps({"repetition": rep, "start": window_start+offsets[start], "end": window_start+offsets[end]}, ensure_ascii=False)+"\n")
+                
+                done, window_start = window_start+offsets[boundary], window_start+offsets[next_start]
+                report["windows"], report["spans"], grow = report["windows"]+1, report["spans"]+len(spans), 1
+        finally:
+            if spans_file != None: spans_file.close()
+            if size > 0: data.close()
+    
+    os.replace(output_path+".part", output_path)
+    report["bytes_read"], report["bytes_written"] = size, os.path.getsize(output_path)
+    return report
+
+
+
 #SHOW THE REPETITIONS INSIDE A TEXT
 #Motivation: to clearly see what repetitions are found and where
 #Process: calculate and show the repetition percentage, the found repetitions, and the text where the color tokens are placed at the beginning and end of each repetition span
-#Asssosiated parameters: color, repetitions_spans() parameters, clean_text() parameters
+#Asssosiated parameters: color, analyze() parameters, clean_text() parameters (text can also be a RepetitionAnalysis)
 def showcase(text: str, **kwargs) -> None:
     kwargs = {**defaults, **kwargs}
     try:replacement_token = kwargs["replacement_token"]
@@ -384,31 +1217,377 @@ def showcase(text: str, **kwargs) -> None:
     else: 
         print(f"The color {color} is not available, repetitions are highlighted in red.")
         color, color_chr = "red", colors["red"]
-    col_len = len(color_chr)
-    repetitions_spans = find_spans(text, **kwargs)
-    cleaned_text = clean_text(text, **kwargs)
+    analysis = text if isinstance(text, RepetitionAnalysis) else analyze(text, **kwargs)
+    text = analysis.text
+    repetitions_spans = analysis.spans
+    cleaned_text = clean_text(analysis, **kwargs)
     repetition_percent = round(100-len(cleaned_text)/len(text)*100, 2)
 
-    marked_text = text
-    index_shift=0
-    spans = []
-    for i in sorted(repetitions_spans.values()):
-        spans.extend(i)
-    for span in spans:
-        start = span[0]+index_shift
-        end = span[1]+index_shift
-        marked_text = marked_text[:start]+color_chr+marked_text[start:end]+end_chr+marked_text[end:]
-        index_shift += col_len+end_len-3
+    #placing the color tokens in one pass, the end of a span goes before the start of the next one
+    markers = []
+    for spans in repetitions_spans.values():
+        for span in spans: markers.extend([(span[0], 1, color_chr), (span[1], 0, end_chr)])
+    pieces, last_position = [], 0
+    for position, _, marker in sorted(markers):
+        pieces.extend([text[last_position:position], marker])
+        last_position = position
+    pieces.append(text[last_position:])
+    marked_text = "".join(pieces)
     
     print(f"This text contains {repetition_percent}% repetitions. The following repetitions were found:")
     if repetitions_spans != {}:
         print(' | '.join([color_chr+i+end_chr for i in repetitions_spans.keys()]))
     print()
     print(marked_text)
-            
 
-    
 
+
+#CLEAN ONE FILE
+#Motivation: to let the worker processes read and write the files themselves, so only the paths are sent between processes
+#Process: reads a json, cleans it with clean() and writes it to the output path through a temporary file
+         #any other file is cleaned as plain text by clean_large_file(), window by window, a jsonl is cleaned by _clean_jsonl_file() instead
+         #so an interrupted run never leaves a half-written output that would be skipped when resuming
+         #returns the input path, the number of bytes read and the error message if the file could not be cleaned
+#Asssosiated parameters: clean() parameters
+def _clean_file(paths: tuple, **kwargs) -> tuple:
+    input_path, output_path = paths
+    try:
+        if not input_path.endswith(".json"): return input_path, clean_large_file(input_path, output_path, **kwargs)["bytes_read"], None
+        with open(input_path, encoding="utf-8") as file: content = file.read()
+        cleaned = json.dumps(clean(json.loads(content), **kwargs), ensure_ascii=False)
+        
+        os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+        with open(output_path+".part", "w", encoding="utf-8") as file: file.write(cleaned)
+        os.replace(output_path+".part", output_path)
+        return input_path, len(content.encode("utf-8")), None
+    except Exception as error: return input_path, 0, f"{type(error).__name__}: {error}"
+
+
+#CLEAN ONE LINE OF A JSONL STREAM
+#Motivation: to send the raw lines to the worker processes instead of pickling the parsed jsons
+#Process: parses the line, cleans it with clean() and returns the cleaned line, its size in bytes and the error message if it could not be cleaned
+#Asssosiated parameters: clean() parameters
+def _clean_line(line: str, **kwargs) -> tuple:
+    try: return json.dumps(clean(json.loads(line), **kwargs), ensure_ascii=False), len(line.encode("utf-8")), None
+    except Exception as error: return None, 0, f"{type(error).__name__}: {error}"
+
+
+#GIVE A STREAM TO THE WORKER PROCESSES
+#Motivation: Pool.imap() reads its whole input in a background thread, so a stream larger than the memory would be read into it
+#Process: takes batch_size tasks at a time with islice() and gives only them to the pool, two batches are in the pool at once,
+         #so the workers clean the next batch while the slowest tasks of this one finish and its results are given back
+#Example: _map_bounded(pool, worker, (line for line in sys.stdin), 1, False, 64) -> (worker(line) for every line, in order)
+def _map_bounded(pool, worker, tasks, chunksize: int, unordered: bool, batch_size: int):
+    tasks = iter(tasks)
+    submit = pool.imap_unordered if unordered else pool.imap
+    batch = list(islice(tasks, batch_size))
+    results = submit(worker, batch, chunksize) if len(batch) > 0 else None
+    while results != None:
+        batch = list(islice(tasks, batch_size))
+        next_results = submit(worker, batch, chunksize) if len(batch) > 0 else None
+        yield from results
+        results = next_results
+
+
+#CLEAN ONE JSONL FILE
+#Motivation: to clean a jsonl file with all the worker processes, line by line, instead of reading it whole in one of them
+#Process: the lines are given to map_lines like the lines of stdin, the cleaned ones are written in order to the output path through a temporary file
+         #returns the same as _clean_file(), the output is not written if any of the lines could not be cleaned
+#Asssosiated parameters: map_lines (maps _clean_line() over the lines, in order)
+def _clean_jsonl_file(paths: tuple, map_lines) -> tuple:
+    input_path, output_path = paths
+    try:
+        os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+        size = 0
+        with open(input_path, encoding="utf-8") as file, open(output_path+".part", "w", encoding="utf-8") as output:
+            for line, line_size, error in map_lines(line for line in file if line.strip() != ""):
+                if error != None: raise ValueError(error)
+                output.write(line+"\n")
+                size += line_size
+        os.replace(output_path+".part", output_path)
+        return input_path, size, None
+    except Exception as error:
+        if os.path.exists(output_path+".part"): os.remove(output_path+".part")
+        return input_path, 0, f"{type(error).__name__}: {error}"
+
+
+#FIND THE FILES TO CLEAN
+#Motivation: to accept directories, glob patterns and files in the same way
+#Process: directories are searched recursively for .json and .jsonl files, the relative paths are kept in the output directory
+         #glob patterns and files are written into the output directory by their names
+#Example: ["transcripts/"], "cleaned" -> [("transcripts/a.json", "cleaned/a.json"), ("transcripts/day2/b.jsonl", "cleaned/day2/b.jsonl")]
+def _find_files(inputs: list, output_dir: str) -> list:
+    files = []
+    for pattern in inputs:
+        if os.path.isdir(pattern):
+            for extension in ("json", "jsonl"):
+                for path in glob.glob(os.path.join(pattern, "**", "*."+extension), recursive=True):
+                    files.append((path, os.path.join(output_dir, os.path.relpath(path, pattern))))
+        else:
+            for path in sorted(glob.glob(pattern)) or [pattern]:
+                files.append((path, os.path.join(output_dir, os.path.basename(path))))
+                
+    return sorted(set(files))
+
+
+#WORKER PROCESSES OF THE CLEANING SERVER
+#Motivation: to keep the worker processes warm, so the requests do not pay for the start-up, the punctuation tables and a cold cache
+#Process: every worker keeps the clean() parameters, its own RepetitionCache (unless one is given) and fills the punctuation table
+         #for the most common characters once when it starts, then cleans whole batches and gives back the result or the error of each
+_worker_kwargs = {}
+def _start_worker(kwargs: dict):
+    global _worker_kwargs
+    _worker_kwargs = {**kwargs, "cache": kwargs["cache"] if kwargs["cache"] != None else RepetitionCache()}
+    preprocess("".join(map(chr, range(32, 0x600))), **_worker_kwargs)
+
+
+def _clean_batch(objects: list) -> list:
+    results = []
+    for obj in objects:
+        try: results.append((clean(obj, **_worker_kwargs), None))
+        except Exception as error: results.append((None, f"{type(error).__name__}: {error}"))
+    return results
+
+
+
+#CLEANING SERVER
+#Motivation: to clean thousands of short texts and segments per second from another program without starting python for every call
+#Process: an asyncio HTTP server on a port or a Unix socket, POST /clean takes what clean() takes as a json body
+         #(a text, a list of segments or a json with "text" and "segments") or a text/plain body, GET /metrics gives the metrics
+         #the requests wait in a queue of at most max_queue, once it is full the new requests are refused with 503 right away
+         #a worker is given all waiting requests (at most batch_size) as one batch as soon as it is free, so the batches grow with the load
+         #with batch_delay, the first request of a batch waits that many seconds for more to come
+         #every worker has at most one batch at a time, so when the workers are slow the queue fills up instead of the memory
+         #the metrics are the queue depth, the batches being cleaned, the served, refused and failed requests, the mean batch size
+         #and the latency percentiles of the last 10000 requests in milliseconds
+#Asssosiated parameters: workers, batch_size, batch_delay, max_queue, max_body, clean() parameters
+#Example: python -m repetitions_finder --serve --port 8765 --workers 4
+         #curl -s localhost:8765/clean -d '"Thank you. Thank you. Thank you. Thank you."' -> "Thank you."
+         #curl -s localhost:8765/metrics -> {"queue_depth": 0, "in_flight_batches": 0, "served": 1, ...}
+class CleaningServer:
+    statuses = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 413: "Payload Too Large",
+                500: "Internal Server Error", 503: "Service Unavailable"}
+
+    def __init__(self, workers: int=None, batch_size: int=64, batch_delay: float=0.0, max_queue: int=1024, max_body: int=2**24, **kwargs):
+        workers = workers if workers != None else os.cpu_count() or 1
+        for name, value in (("workers", workers), ("batch_size", batch_size), ("max_queue", max_queue), ("max_body", max_body)):
+            if type(value) != int or value < 1: raise TypeError(f"{name} can only be a positive integer!")
+        if batch_delay < 0: raise TypeError("batch_delay can only be a non-negative number!")
+        self.kwargs = {**defaults, **kwargs}
+        self.workers, self.batch_size, self.batch_delay, self.max_queue, self.max_body = workers, batch_size, batch_delay, max_queue, max_body
+        self.served, self.refused, self.failed, self.batches, self.batched, self.in_flight = 0, 0, 0, 0, 0, 0
+        self.latencies = deque(maxlen=10000)
+        self.pool, self.server, self.batcher = None, None, None
+
+    async def start(self, host: str="127.0.0.1", port: int=8765, unix_path: str=None):
+        self.pool = Pool(self.workers, initializer=_start_worker, initargs=(self.kwargs,))
+        self.queue, self.free_workers = asyncio.Queue(self.max_queue), asyncio.Semaphore(self.workers)
+        self.batcher = asyncio.create_task(self._batch())
+        if unix_path != None: self.server = await asyncio.start_unix_server(self._handle, path=unix_path)
+        else: self.server = await asyncio.start_server(self._handle, host, port)
+        self.started = time.perf_counter()
+        return self.server
+
+    async def close(self):
+        if self.server != None:
+            self.server.close()
+            await self.server.wait_closed()
+        if self.batcher != None: self.batcher.cancel()
+        if self.pool != None: self.pool.terminate()
+
+    async def _batch(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await self.free_workers.acquire()
+            batch = [await self.queue.get()]
+            if self.batch_delay > 0: await asyncio.sleep(self.batch_delay)
+            while len(batch) < self.batch_size and not self.queue.empty(): batch.append(self.queue.get_nowait())
+            self.in_flight, self.batches, self.batched = self.in_flight+1, self.batches+1, self.batched+len(batch)
+            #the callbacks run in a thread of the pool, the results are handed back to the event loop
+            self.pool.apply_async(_clean_batch, ([obj for obj, _ in batch],),
+                                  callback=lambda results, batch=batch: loop.call_soon_threadsafe(self._finish, batch, results, None),
+                                  error_callback=lambda error, batch=batch: loop.call_soon_threadsafe(self._finish, batch, None, error))
+
+    def _finish(self, batch: list, results: list, error: Exception):
+        self.in_flight -= 1
+        self.free_workers.release()
+        for i, (_, future) in enumerate(batch):
+            if future.done(): continue
+            if error != None: future.set_exception(error)
+            else: future.set_result(results[i])
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line: break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""): break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                try: method, path, version = request_line.decode("latin-1").split()
+                except ValueError: method, path, version = "", "", ""
+                length = int(headers.get("content-length", "0")) if headers.get("content-length", "0").isdigit() else -1
+                if length < 0 or length > self.max_body:
+                    await self._respond(writer, 413 if length > self.max_body else 400, {"error": "the body is too large or its length is not given"})
+                    break
+                body = await reader.readexactly(length)
+                status, payload = await self._answer(method, path.split("?")[0], headers, body) if version != "" else (400, {"error": "bad request line"})
+                await self._respond(writer, status, payload)
+                if version != "HTTP/1.1" or headers.get("connection", "").lower() == "close": break
+        except (asyncio.IncompleteReadError, ConnectionError): pass
+        finally: writer.close()
+
+    async def _answer(self, method: str, path: str, headers: dict, body: bytes) -> tuple:
+        if path == "/metrics": return (200, self.metrics()) if method == "GET" else (405, {"error": "use GET"})
+        if path != "/clean": return 404, {"error": "use POST /clean or GET /metrics"}
+        if method != "POST": return 405, {"error": "use POST"}
+        try: obj = body.decode("utf-8") if headers.get("content-type", "").startswith("text/plain") else json.loads(body)
+        except ValueError as error: return 400, {"error": f"the body is not valid json: {error}"}
+        if self.queue.full():
+            self.refused += 1
+            return 503, {"error": "the queue is full, try again later"}
+        
+        started, future = time.perf_counter(), asyncio.get_running_loop().create_future()
+        self.queue.put_nowait((obj, future))
+        try: result, error = await future
+        except Exception as error:
+            self.failed += 1
+            return 500, {"error": f"{type(error).__name__}: {error}"}
+        self.latencies.append(time.perf_counter()-started)
+        if error != None:
+            self.failed += 1
+            return 400, {"error": error}
+        self.served += 1
+        return 200, result
+
+    async def _respond(self, writer, status: int, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        head = f"HTTP/1.1 {status} {self.statuses[status]}\r\nContent-Type: application/json; charset=utf-8\r\nContent-Length: {len(body)}\r\n"
+        if status == 503: head += "Retry-After: 1\r\n"
+        writer.write(head.encode("latin-1")+b"\r\n"+body)
+        await writer.drain()
+
+    def metrics(self) -> dict:
+        latencies = sorted(self.latencies)
+        percentile = lambda q: round(latencies[min(int(q*len(latencies)), len(latencies)-1)]*1000, 3) if latencies else None
+        return {"queue_depth": self.queue.qsize(), "max_queue": self.max_queue, "in_flight_batches": self.in_flight, "workers": self.workers,
+                "served": self.served, "refused": self.refused, "failed": self.failed, "batches": self.batches,
+                "mean_batch_size": round(self.batched/self.batches, 2) if self.batches else None,
+                "latency_ms": {"p50": percentile(0.5), "p90": percentile(0.9), "p99": percentile(0.99), "max": percentile(1)},
+                "uptime_seconds": round(time.perf_counter()-self.started, 3)}
+
+
+#STARTING THE CLEANING SERVER
+#Motivation: to run a CleaningServer until it is stopped with Ctrl+C
+#Asssosiated parameters: CleaningServer parameters
+#Example: serve(port=8765, workers=4, engine="suffix_array")
+def serve(host: str="127.0.0.1", port: int=8765, unix_path: str=None, **kwargs) -> None:
+    async def run():
+        server = CleaningServer(**kwargs)
+        await server.start(host, port, unix_path)
+        print(f"Cleaning on {unix_path if unix_path != None else f'http://{host}:{port}'} with {server.workers} workers", file=sys.stderr)
+        try: await server.server.serve_forever()
+        finally: await server.close()
+    try: asyncio.run(run())
+    except KeyboardInterrupt: pass
+
+
+
+#CLEAN FILES FROM THE COMMAND LINE
+#Motivation: to clean whole directories of transcripts in parallel without writing a multiprocessing script around clean()
+#Process: python -m repetitions_finder INPUT [INPUT ...] -o OUTPUT_DIR cleans every json/jsonl file into the output directory
+         #other files given by name or glob pattern are cleaned as plain text, in windows, so they can be larger than the memory
+         #python -m repetitions_finder - cleans a jsonl stream from stdin line by line and writes it to stdout
+         #the tasks are given to a pool of worker processes in chunks, the results come back in order unless --unordered is passed
+         #the lines of stdin and of every jsonl file are read in bounded batches, so a stream or a file can be larger than the memory
+         #the json and plain text files are cleaned first, one per worker, then the jsonl files one after another with all the workers
+         #a line that cannot be cleaned fails its whole input: its jsonl file is not written, and stdin stops there with exit code 1
+         #files whose outputs already exist are skipped unless --overwrite is passed, so a stopped run can be resumed
+         #the number of files (or lines), megabytes and the throughput are reported to stderr at the end
+         #python -m repetitions_finder --serve starts a CleaningServer with the same parameters instead
+#Asssosiated parameters: allow_repetitions, suspicious_length, n_grams_span, engine, cache, CleaningServer parameters
+#Example: python -m repetitions_finder transcripts/ "more/*.json" -o cleaned --workers 8 --engine suffix_array
+         #python -m repetitions_finder --serve --unix /tmp/repetitions.sock --workers 8
+def main(argv: list=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m repetitions_finder", description="Remove repetitions from Whisper-style transcripts.")
+    parser.add_argument("inputs", nargs="*", help='directories, glob patterns or .json/.jsonl files, or "-" for a jsonl stream on stdin')
+    parser.add_argument("-o", "--output", help="the output directory (required unless the input is stdin)")
+    parser.add_argument("-w", "--workers", type=int, default=os.cpu_count() or 1, help="the number of worker processes")
+    parser.add_argument("--chunksize", type=int, default=1, help="the number of files or lines given to a worker at once")
+    parser.add_argument("--unordered", action="store_true", help="write the results as soon as they are ready")
+    parser.add_argument("--overwrite", action="store_true", help="clean the files whose outputs already exist again")
+    parser.add_argument("--allow-repetitions", type=int, default=defaults["allow_repetitions"])
+    parser.add_argument("--suspicious-length", type=int, default=defaults["suspicious_length"])
+    parser.add_argument("--n-grams-span", type=int, nargs=2, default=defaults["n_grams_span"], metavar=("MIN", "MAX"))
+    parser.add_argument("--engine", choices=["ngrams", "suffix_array", "numpy"], default=defaults["engine"])
+    parser.add_argument("--cache", metavar="PATH", help="an sqlite file to keep the found repetitions in, shared by the workers and later runs")
+    parser.add_argument("--serve", action="store_true", help="start a cleaning server instead of cleaning files")
+    parser.add_argument("--host", default="127.0.0.1", help="the address the server listens on")
+    parser.add_argument("--port", type=int, default=8765, help="the port the server listens on")
+    parser.add_argument("--unix", metavar="PATH", help="listen on a Unix socket instead of a port")
+    parser.add_argument("--batch-size", type=int, default=64, help="the most requests the server gives to a worker at once")
+    parser.add_argument("--batch-delay", type=float, default=0.0, help="seconds a request waits for others to be batched with")
+    parser.add_argument("--max-queue", type=int, default=1024, help="the most requests waiting before new ones are refused")
+    args = parser.parse_args(argv)
+    
+    kwargs = {"allow_repetitions": args.allow_repetitions, "suspicious_length": args.suspicious_length,
+              "n_grams_span": tuple(args.n_grams_span), "engine": args.engine}
+    if args.cache != None: kwargs["cache"] = RepetitionCache(path=args.cache)
+    if args.serve:
+        if args.workers < 1 or args.batch_size < 1 or args.max_queue < 1: parser.error("workers, batch-size and max-queue can only be positive integers")
+        serve(args.host, args.port, args.unix, workers=args.workers, batch_size=args.batch_size, batch_delay=args.batch_delay,
+              max_queue=args.max_queue, **kwargs)
+        return 0
+    if len(args.inputs) == 0: parser.error("the inputs are required unless --serve is passed")
+    stream = args.inputs == ["-"]
+    if not stream and args.output == None: parser.error("the output directory is required, pass it with -o")
+    if args.workers < 1 or args.chunksize < 1: parser.error("workers and chunksize can only be positive integers")
     
+    if not stream:
+        tasks = _find_files(args.inputs, args.output)
+        skipped = len(tasks)
+        if not args.overwrite: tasks = [task for task in tasks if not os.path.exists(task[1])]
+        skipped -= len(tasks)
+    line_worker, file_worker = partial(_clean_line, **kwargs), partial(_clean_file, **kwargs)
     
-    
\ No newline at end of file
+    done, failed, size, started = 0, 0, 0, time.perf_counter()
+    pool = Pool(args.workers) if args.workers > 1 else None
+    #a few chunks for every worker are read ahead, the rest of the stream waits
+    batch_size = args.workers*args.chunksize*16
+    def map_lines(lines, unordered=False):
+        if pool == None: return map(line_worker, lines)
+        return _map_bounded(pool, line_worker, lines, args.chunksize, unordered, batch_size)
+    try:
+        if stream: results = map_lines((line for line in sys.stdin if line.strip() != ""), args.unordered)
+        else:
+            files = [task for task in tasks if not task[0].endswith(".jsonl")]
+            if pool == None: results = map(file_worker, files)
+            elif args.unordered: results = pool.imap_unordered(file_worker, files, args.chunksize)
+            else: results = pool.imap(file_worker, files, args.chunksize)
+            results = chain(results, (_clean_jsonl_file(task, map_lines) for task in tasks if task[0].endswith(".jsonl")))
+        for result, result_size, error in results:
+            if error != None:
+                failed += 1
+                print(f"Could not clean {result if not stream else 'line '+str(done+1)}: {error}", file=sys.stderr)
+                #like a jsonl file with such a line is not written, the stream stops there, so the written lines match the read ones
+                if stream: break
+                continue
+            if stream: sys.stdout.write(result+"\n")
+            done, size = done+1, size+result_size
+    finally:
+        if pool != None: pool.terminate()
+    
+    seconds = max(time.perf_counter()-started, 1e-9)
+    unit = "lines" if stream else "files"
+    report = f"Cleaned {done} {unit} ({size/2**20:.2f} MB) in {seconds:.2f} s: {done/seconds:.2f} {unit}/s, {size/2**20/seconds:.2f} MB/s"
+    if not stream and skipped > 0: report += f", skipped {skipped} already cleaned"
+    if failed > 0: report += f", failed {failed}"
+    print(report, file=sys.stderr)
+    return 1 if failed > 0 else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,60 @@
+#REGRESSION TESTS FOR repetitions_finder
+#Process: run with "python -m pytest test_repetitions_finder.py"
+
+import repetitions_finder as rf
+import benchmark
+
+
+
+#the same syllable must be searched in one phase only, searching two rotations pads the characters between them
+def test_merged_repetitions_are_not_rotated():
+    assert rf.find_repetitions("nalalalalalala wolalalalalala") == ["la"]
+    assert rf.clean_text("nalalalalalala wolalalalalala") == "nala wola"
+    assert rf.clean_text("la la la la nalalalalalala") == "la nala"
+    #the "a" merged with itself over the "l"s must not take the kept last character of "la"
+    assert "Wasla!!" in rf.clean_text(benchmark.generate_text(10000))
+    assert rf.clean_text(" Waslalalalalalalalalala!! A a a a.") == " Wasla!! A."
+    assert rf.clean_text("you thelalalalalalala a a. a, a a a a you") == "you thela. a, a you"
+
+
+#with engine="numpy", the word spans may only replace the text search when the repetition cannot occur inside another word
+def test_numpy_spans_match_the_text_search():
+    for text in ["la la la la nalalalalalala", "two two two two xtwo two two", "One, two, one, two, one, two."]:
+        assert rf.find_spans(text, engine="numpy") == rf.find_spans(text, engine="ngrams")
+    assert rf.find_spans("two two two two xtwo two two", engine="numpy") == {"two": [(0, 15), (17, 28)]}
+
+
+#a window without enough words to become final may grow only up to 8*window_size, then it is cut
+def test_clean_large_file_caps_the_window(tmp_path):
+    (tmp_path / "in.txt").write_text("ab"*5000, encoding="utf-8")
+    report = rf.clean_large_file(str(tmp_path / "in.txt"), str(tmp_path / "out.txt"), window_size=256)
+    assert report["windows"] > 1
+    assert (tmp_path / "out.txt").read_text(encoding="utf-8").startswith("ab")
+
+
+#the segments have the same form whether something was cleaned or not, and the text is screened only once
+def test_clean_returns_one_form():
+    segments = [{"id": 5, "start": 0, "end": 1, "text": " Hello there.", "words": [], "tokens": [1]}, {"id": 6, "start": 1, "end": 2, "text": "", "words": []}]
+    expected = [{"id": 0, "start": 0, "end": 1, "text": " Hello there.", "words": []}]
+    assert rf.clean_segments(segments) == expected
+    assert rf.clean({"text": " Hello there.", "segments": segments, "language": "en"}) == {"text": " Hello there.", "segments": expected}
+    assert rf.clean_segments(expected) is expected
+    words = [{"word": word, "start": 0, "end": 1} for word in [" Two,", " two,", " two,", " two."]]
+    repeated = [dict(expected[0], text=" Two, two, two, two.", words=words, tokens=[1])]
+    assert set(rf.clean_segments(repeated)[0]) == set(expected[0])
+
+    stats = rf.RepetitionStats()
+    rf.clean({"text": " Hello there.", "segments": segments}, stats=stats)
+    assert stats.as_dict()["calls"]["preprocess"] == 1 and stats.as_dict()["calls"]["has_repetitions"] == 1
+
+
+#changing a returned analysis must not change what the cache gives to the next caller
+def test_cache_keeps_its_own_copy(tmp_path):
+    text = " Thank you. Thank you. Thank you. Thank you."
+    for cache in [rf.RepetitionCache(), rf.RepetitionCache(path=str(tmp_path / "cache.sqlite"))]:
+        analysis = rf.analyze(text, cache=cache)
+        analysis.spans.clear()
+        analysis.repetitions.clear()
+        assert rf.clean(text, cache=cache) == " Thank you."
+        rf.analyze(text, cache=cache).spans.clear()
+        assert rf.clean(text, cache=cache) == " Thank you."